@@ -1,31 +1,139 @@
+import time
+_import_started = time.perf_counter()
 import gradio as gr
 from dotenv import load_dotenv
-from groq import Groq
-import speech_recognition as sr 
 import os
-from gtts import gTTS
-import time;
-import folium
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
+from metrics import metrics, span, log_event, new_request_id, ensure_request_id, record_error, record_tokens, RATE_BUCKETS
+from router import ModelRouter, TASK_MODELS
+from sessions import open_session_store, new_session_id, valid_session_id, SESSION_STORE
+import http_clients
+from http_clients import get_async_client, geopy_adapter_factory, REQUEST_TIMEOUT
+import logging
+import contextvars
+import asyncio
+import base64
+import re
+import json
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait
+import html
+import numpy as np
+
+# Groq, gTTS, speech recognition and geopy are imported on first use, so a cold start only
+# pays for gradio and the UI comes up before any of those subsystems is needed
 
 load_dotenv()
 API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=API_KEY)
-
-def transcribe_audio(audio_path):
-    recognizer = sr.Recognizer()
-    with sr.AudioFile(audio_path) as source:
-        # Read voice file
-        audio = recognizer.record(source)
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        from groq import AsyncGroq
+        _client = AsyncGroq(api_key=API_KEY, http_client=get_async_client("groq"))
+    return _client
+
+# Every LLM call goes through the router, which picks the model for the task (see router.py)
+model_router = ModelRouter(get_client, TASK_MODELS)
+
+# Event concurrency: handlers are async, so these bound in-flight LLM streams rather than threads
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", 200))
+PLAN_CONCURRENCY = int(os.getenv("PLAN_CONCURRENCY", 50))
+DEFAULT_CONCURRENCY = int(os.getenv("DEFAULT_CONCURRENCY", 8))
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", 1000))
+
+# Streaming window: UI updates are sent at most every STREAM_FLUSH_INTERVAL seconds
+# or STREAM_FLUSH_CHARS new characters, whichever comes first
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", 0.05))
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", 64))
+
+# Yields the accumulated text of a streaming completion once per streaming window,
+# and always once at the end. Also records time to first token and output tokens for task.
+async def coalesce_stream(completion, task="chat", started=None):
+    started = started or time.perf_counter()
+    text = ""
+    flushed = 0
+    chunks = 0
+    first_token = None
+    last_flush = time.monotonic()
+    async for chunk in completion:
+        content = chunk.choices[0].delta.content or ""
+        if content:
+            # Each streamed chunk carries about one token
+            chunks += 1
+            if first_token is None:
+                first_token = time.perf_counter()
+                metrics.observe("tripper_ttft_seconds", first_token - started, task=task)
+        text += content
+        now = time.monotonic()
+        if len(text) - flushed >= STREAM_FLUSH_CHARS or (len(text) > flushed and now - last_flush >= STREAM_FLUSH_INTERVAL):
+            flushed = len(text)
+            last_flush = now
+            yield text
+    if len(text) > flushed or not text:
+        yield text
+
+    record_tokens(task, tokens_out=chunks)
+    if first_token and chunks > 1:
+        elapsed = time.perf_counter() - first_token
+        if elapsed > 0:
+            metrics.observe("tripper_tokens_per_second", chunks / elapsed, buckets=RATE_BUCKETS, task=task)
+
+# Local cache files (geocodes, ...) live here
+CACHE_DIR = os.getenv("TRIPPER_CACHE_DIR", ".cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Writes through a temp file in the same directory so readers never see a partial file
+def atomic_write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
     try:
-        # Google voice recognition
-        text = recognizer.recognize_google(audio)
-        return text
-    except sr.UnknownValueError:
-        return "Cannot read voice"
-    except sr.RequestError:
-        return "Not avaliable"
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# Total size of the files under a directory
+def directory_size(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+# Deletes the least recently used files (oldest mtime first) until the directory
+# holds at most max_bytes. Returns (files removed, bytes left).
+def evict_to_size(directory, max_bytes):
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed, total
 
 def process_input(history, message):
     if history is None:
@@ -33,24 +141,240 @@ def process_input(history, message):
 
     user_text = ""
     files = message.get("files", [])  
-    if files:
-        for file in files:
-            if file.endswith(".wav") or file.endswith(".mp3"):  
-                transcribed_text = transcribe_audio(file)
-                user_text = f"[🎤 Voice:]: {transcribed_text}"
-                history.append((transcribed_text, ""))  
+    audio_files = [file for file in files if file.endswith(".wav") or file.endswith(".mp3")]
+    # Several recordings are transcribed in parallel, answers come back in upload order
+    transcriptions = []
+    if audio_files:
+        with span("speech.transcribe", files=len(audio_files)):
+            from speech import transcribe_files
+            transcriptions = transcribe_files(audio_files)
+    for transcribed_text in transcriptions:
+        user_text = f"[🎤 Voice:]: {transcribed_text}"
+        history.append({"role": "user", "content": transcribed_text})
     
     if message.get("text"):  
         user_text = message["text"]
-        history.append((user_text, ""))
+        history.append({"role": "user", "content": user_text})
 
     return history, gr.MultimodalTextbox(value=None, interactive=True)
 
-def generate_plan(details, destination, interests, num_days, budget, time_period, num_people_slider, currency, language):
+PLANNER_SYSTEM_PROMPT = "You are a holiday planner. Provide structured responses about attractions to visit, hotels to stay at, and restaurants to eat at on holiday. You can respond in many languages when prompted."
+
+# Single-call mode: the markdown plan streams first, then a marker line and a JSON list
+# of its places, so the places come out of the same completion as the plan
+STRUCTURED_PLAN = os.getenv("STRUCTURED_PLAN", "1") == "1"
+PLACE_TYPES = ("destination", "hotel", "restaurant", "attraction", "museum")
+PLACES_MARKER = "<<<PLACES>>>"
+STRUCTURED_PLAN_PROMPT = (
+    "Write the full travel plan in markdown. After the plan, write a line containing only "
+    + PLACES_MARKER + " followed by a JSON list of objects {\"name\": string, \"type\": one of "
+    + ", ".join(PLACE_TYPES) + "} naming every hotel, restaurant, attraction and museum in the plan, "
+    "with the destination city first and typed as \"destination\". "
+    "Use the names exactly as they appear in the plan and write nothing after the list."
+)
+
+# Returns the part of a (possibly partial) structured response that should be shown to the user
+def visible_plan_text(text):
+    visible = text.split(PLACES_MARKER)[0]
+    if PLACES_MARKER not in text:
+        # Hold back a marker that is still being streamed
+        for size in range(len(PLACES_MARKER) - 1, 0, -1):
+            if visible.endswith(PLACES_MARKER[:size]):
+                return visible[:-size]
+    return visible.rstrip()
+
+# Validates the places block and returns the newline separated list generate_map expects
+# (destination first). Raises ValueError if it is missing or does not match the schema.
+def parse_plan_places(text):
+    if PLACES_MARKER not in text:
+        raise ValueError("plan has no places block")
+    block = text.split(PLACES_MARKER, 1)[1].strip()
+    block = re.sub(r"^```(?:json)?|```$", "", block).strip()
+    entries = json.loads(block)
+    if not isinstance(entries, list):
+        raise ValueError("places is not a list")
+
+    names = []
+    destinations = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"invalid place entry: {entry!r}")
+        name = entry.get("name")
+        place_type = str(entry.get("type", "")).lower()
+        if not isinstance(name, str) or not name.strip() or place_type not in PLACE_TYPES:
+            raise ValueError(f"invalid place entry: {entry!r}")
+        name = " ".join(name.split())
+        if place_type == "destination":
+            destinations.append(name)
+        elif name not in names:
+            names.append(name)
+    if not destinations or not names:
+        raise ValueError("places needs a destination and at least one place")
+
+    return "\n".join(destinations[:1] + names)
+
+# Plan cache settings
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", 512))
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", 24 * 3600))
+
+# In-memory LRU + TTL cache of finished plans: {"plan", "places", "map", "language", "translations"}.
+# "plan" is the plan as generated, in "language"; the other languages are translations of it
+# and share its places and map.
+class PlanCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "translation_hits": 0, "translations": 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["expires_at"] <= time.time():
+                del self.entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key, plan, places, language):
+        with self.lock:
+            self.entries[key] = {"plan": plan, "places": places, "map": None, "language": language, "translations": {}, "expires_at": time.time() + self.ttl}
+            self.entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_map(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry["map"] if entry else None
+
+    def set_map(self, key, map_html):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]["map"] = map_html
+
+    def set_places(self, key, places):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]["places"] = places
+
+    def get_translation(self, key, language):
+        with self.lock:
+            entry = self.entries.get(key)
+            plan = entry["translations"].get(language) if entry else None
+            if plan is not None:
+                self.stats["translation_hits"] += 1
+            return plan
+
+    def set_translation(self, key, language, plan):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]["translations"][language] = plan
+                self.stats["translations"] += 1
+
+plan_cache = PlanCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL)
+
+# The planner prompt only mentions budgets above the slider's lowest USD value
+def budget_in_prompt(budget):
+    return bool(budget) and budget > 100
+
+# Cache key for a planner request. Text fields are normalized and the budget is bucketed
+# so "Paris", " paris." and a budget of 1000 or 1100 USD share one plan. No budget (or one
+# the prompt leaves out) is None, never a bucket. The language is left out: other languages
+# are served by translating the cached plan.
+def plan_cache_key(details, destination, interests, num_days, budget, time_period, num_people_slider, currency):
+    def normalize(text):
+        return re.sub(r"\s+", " ", (text or "").lower()).strip(" .,;!")
+    min_budget = CURRENCY_MAP.get(currency, ("", 100, 0))[1]
+    budget_bucket = round(budget / (min_budget * 5)) if budget_in_prompt(budget) else None
+    return json.dumps([
+        normalize(details), normalize(destination), normalize(interests),
+        max(num_days or 1, 1), budget_bucket, normalize(time_period),
+        max(num_people_slider or 1, 1), currency
+    ], ensure_ascii=False)
+
+TRANSLATE_PROMPT = (
+    "Translate the travel plan you are given into {language}. Keep the markdown formatting, "
+    "numbers and prices as they are, and keep the names of places exactly as written. "
+    "Reply with the translated plan only."
+)
+
+# Streams a cached plan translated into language; the fast model is enough for this
+async def translate_plan(plan_text, language):
+    messages = [
+        {"role": "system", "content": TRANSLATE_PROMPT.format(language=language)},
+        {"role": "user", "content": plan_text}
+    ]
+    record_tokens("translate", tokens_in=prompt_tokens(messages))
+    with span("plan.translate", language=language) as fields:
+        started = time.perf_counter()
+        fields["model"], completion = await model_router.stream(
+            "translate",
+            messages=messages,
+            temperature=0.2,
+            max_tokens=4096
+        )
+        async for text in coalesce_stream(completion, "translate", started):
+            yield text
+
+# Cached plan text in language: the plan itself, a cached translation or a new one.
+# Yields the translation while it streams; None when the translation failed.
+async def cached_plan_text(cache_key, cached, language):
+    if cached["language"] == language:
+        yield cached["plan"]
+        return
+    translated = plan_cache.get_translation(cache_key, language)
+    if translated is None:
+        try:
+            translated = ""
+            async for translated in translate_plan(cached["plan"], language):
+                yield translated
+        except Exception as e:
+            log_event("plan_translation_failed", error=repr(e))
+            yield None
+            return
+        plan_cache.set_translation(cache_key, language, translated)
+    yield translated
+
+# Yields (plan text, places, error, cache key, map). The map is filled in while the plan streams
+# (see ProgressiveMap); updates that leave it unchanged carry gr.skip() instead of the HTML.
+async def generate_plan(details, destination, interests, num_days, budget, time_period, num_people_slider, currency, language, regenerate=False, session_id=None, with_map=True):
+    new_request_id()
     
     #Check if an adequate number of fields were field
     if not any([destination, details]):
-        return "", "", "** Please fill either Destination or Trip Details so we know where you are planning to travel.**"
+        yield "", "", "** Please fill either Destination or Trip Details so we know where you are planning to travel.**", None, ""
+        return
+
+    cache_key = plan_cache_key(details, destination, interests, num_days, budget, time_period, num_people_slider, currency)
+    cached = None if regenerate else plan_cache.get(cache_key)
+    if cached:
+        translated = cached["language"] != language
+        plan_text = None
+        async for plan_text in cached_plan_text(cache_key, cached, language):
+            if translated and plan_text:
+                yield plan_text, "", "", None, gr.skip()
+        # A failed translation falls through to a full generation
+        if plan_text:
+            log_event("plan_cache_hit", translated=translated)
+            places = cached["places"]
+            if not places:
+                # Place extraction failed when the plan was stored, so it is tried again
+                places = await extract_places(cached["plan"], destination)
+                plan_cache.set_places(cache_key, places)
+            await asyncio.to_thread(save_session_plan, session_id, plan_text, places, cache_key)
+            yield plan_text, places, "", cache_key, gr.skip()
+            if with_map:
+                yield plan_text, places, "", cache_key, await asyncio.to_thread(generate_plan_map, places, cache_key)
+            return
     
     prompt_parts = ["Generate a travel plan."]
 
@@ -62,7 +386,7 @@ def generate_plan(details, destination, interests, num_days, budget, time_period
         prompt_parts.append(f"Interests: {interests}.")
     if num_days > 1:
         prompt_parts.append(f"Duration: {num_days} days.")
-    if budget > 100:
+    if budget_in_prompt(budget):
         prompt_parts.append(f"Budget: {budget} {currency}.")
     if time_period and time_period.strip():
         prompt_parts.append(f"Time Period: {time_period}.")
@@ -73,35 +397,243 @@ def generate_plan(details, destination, interests, num_days, budget, time_period
     # Final prompt ensuring at least a generic trip plan is generated
     user_prompt = " ".join(prompt_parts)
 
+    system_prompt = PLANNER_SYSTEM_PROMPT
+    if STRUCTURED_PLAN:
+        system_prompt += " " + STRUCTURED_PLAN_PROMPT
     messages = [
-        {"role": "system", "content": "You are a holiday planner. Provide structured responses about attractions to visit, hotels to stay at, and restaurants to eat at on holiday. You can respond in many languages when prompted."},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
 
-    completion = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=messages,
-        temperature=0.7,
-        max_tokens=2048,
-        top_p=0.9,
-    )
+    record_tokens("plan", tokens_in=prompt_tokens(messages))
+    progressive = None
+    try:
+        # Only the completion itself; the steps after it have spans of their own
+        with span("plan.llm") as fields:
+            started = time.perf_counter()
+            try:
+                fields["model"], completion = await model_router.stream(
+                    "plan",
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=3072 if STRUCTURED_PLAN else 2048,
+                    top_p=0.9
+                )
+            except Exception as e:
+                log_event("plan_offline", error=repr(e))
+                yield "", "", "**Tripper going offline, wait a second and try again.**", None, ""
+                return
+
+            progressive = ProgressiveMap(destination) if with_map else None
+            response = ""
+            last_map_update = time.monotonic()
+            async for response in coalesce_stream(completion, "plan", started):
+                map_html = gr.skip()
+                if progressive and time.monotonic() - last_map_update >= MAP_UPDATE_INTERVAL:
+                    last_map_update = time.monotonic()
+                    map_html = await asyncio.to_thread(progressive.update, visible_plan_text(response)) or gr.skip()
+                yield visible_plan_text(response), "", "", None, map_html
+            fields["chars"] = len(response)
+
+        trip_text = visible_plan_text(response)
+        try:
+            places = parse_plan_places(response)
+        except ValueError as e:
+            # No usable places block, fall back to a second extraction call
+            if STRUCTURED_PLAN:
+                record_error("plan.structured", e)
+            places = await extract_places(trip_text, destination)
+
+        with span("plan.store"):
+            plan_cache.put(cache_key, trip_text, places, language)
+            await asyncio.to_thread(save_session_plan, session_id, trip_text, places, cache_key)
+        yield trip_text, places, "", cache_key, gr.skip()
+
+        if progressive:
+            # Most places were looked up while the plan streamed, only the rest is waited for
+            with span("map.finish"):
+                map_html = await asyncio.to_thread(progressive.finish, places)
+            plan_cache.set_map(cache_key, map_html)
+            yield trip_text, places, "", cache_key, map_html
+    finally:
+        if progressive:
+            progressive.close()
+
+
+#Get chosen language 
+TTS_LANGUAGES = {
+    "English": "en",
+    "Français": "fr",
+    "Español": "es",
+    "Deutsch": "de",
+    "Italiano": "it",
+    "日本語": "ja",
+    "中文": "zh"
+}
+# Short sentences are merged so each gTTS request carries at least this many characters
+TTS_MIN_CHARS = int(os.getenv("TTS_MIN_CHARS", 40))
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])|\n+")
+
+def tts_language_code(language):
+    # Dropdown values start with a flag, e.g. "🇫🇷 Français"
+    return TTS_LANGUAGES.get((language or "").split(" ")[-1], "en") #Defaults to english
+
+# Drop markdown so it is not read out loud
+def clean_for_speech(text):
+    return re.sub(r"[*#_`>|]+", "", text).strip()
+
+# Splits the finished sentences off the front of a streaming text.
+# Returns (sentences, number of characters consumed); the rest is still being written.
+def split_sentences(text):
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if len(sentence) >= TTS_MIN_CHARS:
+            sentences.append(sentence)
+            start = match.end()
+    return sentences, start
+
+# gTTS's stream() opens a new requests.Session per request, so the request bodies come from
+# its public get_bodies() and are sent through the shared "gtts" session instead. The URL and
+# the audio pattern in the answer are the ones of the pinned gTTS version (requirements.txt).
+GTTS_URL = "https://translate.google.{tld}/_/TranslateWebserverUi/data/batchexecute"
+GTTS_AUDIO = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+# MP3 bytes for one piece of text, kept in memory
+def synthesize_speech(text, lang):
+    import requests
+    from gtts import gTTS, gTTSError
+    tts = gTTS(text, lang=lang, timeout=REQUEST_TIMEOUT)
+    session = http_clients.get_session("gtts")
+    audio = []
+    for body in tts.get_bodies():
+        try:
+            response = session.post(
+                GTTS_URL.format(tld=tts.tld), data=body, headers=tts.GOOGLE_TTS_HEADERS, timeout=REQUEST_TIMEOUT
+            )
+        except requests.RequestException:
+            raise gTTSError(tts=tts)
+        match = GTTS_AUDIO.search(response.text) if response.ok else None
+        if not match:
+            raise gTTSError(tts=tts, response=response)
+        audio.append(base64.b64decode(match.group(1)))
+    return b"".join(audio)
+
+# Audio cache settings
+TTS_CACHE_DIR = os.path.join(CACHE_DIR, "tts")
+TTS_CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", 200)) * 1024 * 1024)
+
+# Content addressed store of synthesized speech: one mp3 per sha256(language + text),
+# evicted least recently used once the directory goes over max_bytes
+class TTSCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = None  # Measured on the first write, not at startup
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "deduplicated": 0, "evictions": 0}
+
+    def path_for(self, text, lang):
+        key = hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    # Audio for text, synthesized with gTTS only if it is not stored yet.
+    # Concurrent requests for the same text wait on the first one instead of calling gTTS again.
+    def get(self, text, lang):
+        path = self.path_for(text, lang)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            with self.lock:
+                self.stats["hits"] += 1
+            return data
+        except FileNotFoundError:
+            pass
+
+        with self.lock:
+            future = self.inflight.get(path)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[path] = future
+                self.stats["misses"] += 1
+            else:
+                self.stats["deduplicated"] += 1
+        if not owner:
+            return future.result()
 
-    trip_text = completion.choices[0].message.content
-    places = extract_places(trip_text)
+        try:
+            with span("tts.synthesize", chars=len(text)):
+                data = synthesize_speech(text, lang)
+            self.put(text, lang, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[path]
+
+    # Stores already synthesized audio and returns its path. A file that is replaced only
+    # counts once towards the size; the lock keeps two writes of one key from racing.
+    def put(self, text, lang, data):
+        path = self.path_for(text, lang)
+        with self.lock:
+            if self.size is None:
+                self.size = directory_size(self.directory)
+            try:
+                self.size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            atomic_write(path, data)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                removed, self.size = evict_to_size(self.directory, self.max_bytes)
+                self.stats["evictions"] += removed
+        return path
+
+tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+# Synthesizes sentences in order as they arrive and publishes their audio on segments.
+# None on the sentences queue finishes the worker, which then puts None on segments.
+async def tts_worker(sentences, segments, lang):
+    while (sentence := await sentences.get()) is not None:
+        text = clean_for_speech(sentence)
+        if not text:
+            continue
+        try:
+            segments.put_nowait(await asyncio.to_thread(tts_cache.get, text, lang))
+        except Exception as e:
+            record_error("tts.synthesize", e)
+    segments.put_nowait(None)
 
-    return trip_text, places, ""
+# Conversation context settings
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 3000))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 300))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 1024))
 
+# Rough token count (about 4 characters per token), good enough for budgeting
+def estimate_tokens(text):
+    return len(text) // 4 + 1
 
-def chat_with_bot_stream(user_input, audio, language, history):
-    if history is None:
-        history = []
-    history, _ = process_input(history, user_input)
+def prompt_tokens(messages):
+    return sum(estimate_tokens(message["content"]) for message in messages)
 
+# Token counters from the usage block of a non-streaming completion
+def record_usage(task, usage):
+    if usage:
+        record_tokens(task, usage.prompt_tokens or 0, usage.completion_tokens or 0)
 
+def chat_system_prompt(language):
     # Language prompt
     language_prompt = f"Please respond in {language}."
 
-    system_prompt = (
+    return (
         "You are an expert travel guide for more than 100 countries with 10+ years of experience. "
         "You provide detailed vacation plans, suggest popular attractions, local food, and affordable luxury hotels. "
         "Your recommendations are practical and budget-friendly. "
@@ -109,134 +641,857 @@ def chat_with_bot_stream(user_input, audio, language, history):
         "You also speak 10+ languages and can respond in other languages if needed. " + language_prompt
     )
 
-    # Generate with the context, history
+# Running summaries of the turns that no longer fit in the context budget.
+# Entries are keyed by a hash of the summarized turns; a new summary only has to fold the
+# turns added since the longest prefix that was already summarized.
+class ConversationSummaries:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = set()
+        self.tasks = set()  # The event loop only keeps weak references to running tasks
+
+    @staticmethod
+    def prefix_keys(turns):
+        digest = hashlib.sha1()
+        keys = []
+        for turn in turns:
+            digest.update(json.dumps(turn, ensure_ascii=False).encode("utf-8"))
+            keys.append(digest.hexdigest())
+        return keys
+
+    # Best summary available right now for these turns. If it does not cover all of them,
+    # the missing turns are folded in the background for the next request.
+    def get(self, turns):
+        keys = self.prefix_keys(turns)
+        summary, covered = "", 0
+        for n in range(len(keys), 0, -1):
+            if keys[n - 1] in self.entries:
+                self.entries.move_to_end(keys[n - 1])
+                summary, covered = self.entries[keys[n - 1]], n
+                break
+        if covered < len(turns) and keys[-1] not in self.pending:
+            self.pending.add(keys[-1])
+            task = asyncio.create_task(self.update(keys[-1], summary, turns[covered:]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return summary
+
+    async def update(self, key, summary, new_turns):
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in new_turns)
+        try:
+            _, response = await model_router.complete(
+                "summary",
+                messages=[
+                    {"role": "system", "content": "You keep a running summary of a travel planning conversation. Merge the new messages into the summary. Keep destinations, dates, budget, travellers, preferences and decisions. Answer with the summary only, under 150 words."},
+                    {"role": "user", "content": f"Summary so far:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"}
+                ],
+                temperature=0,
+                max_completion_tokens=SUMMARY_MAX_TOKENS,
+            )
+            record_usage("summary", response.usage)
+            self.entries[key] = response.choices[0].message.content.strip()
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        except Exception as e:
+            record_error("chat.summary", e)
+        finally:
+            self.pending.discard(key)
+
+conversation_summaries = ConversationSummaries(SUMMARY_CACHE_SIZE)
+
+# Prompt messages for a chat turn: the system prompt, a summary of older turns and as many
+# recent turns as fit in CHAT_CONTEXT_TOKENS. The newest message is always included.
+def build_chat_messages(history, language):
+    system_prompt = chat_system_prompt(language)
+
+    # Audio answers have no text to send
+    turns = [
+        {"role": message["role"], "content": message["content"]} for message in history
+        if message["role"] in ("user", "assistant") and isinstance(message["content"], str) and message["content"]
+    ]
+
+    budget = CHAT_CONTEXT_TOKENS - estimate_tokens(system_prompt)
+    start = len(turns)
+    while start > 0:
+        cost = estimate_tokens(turns[start - 1]["content"])
+        if start < len(turns) and cost > budget:
+            break
+        budget -= cost
+        start -= 1
+
     messages = [{"role": "system", "content": system_prompt}]
-    for user_msg, ai_response in history[-3:]:  
-        if user_msg:
-            messages.append({"role": "user", "content": user_msg})
-        if ai_response:
-            if isinstance(ai_response, tuple):
-                messages.append({"role": "assistant", "content": ai_response[0]})
-            else:
-                messages.append({"role": "assistant", "content": ai_response})
+    if start > 0:
+        summary = conversation_summaries.get(turns[:start])
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    return messages + turns[start:]
+
+# Short follow-up questions in a running conversation go to the fast model
+SHORT_FOLLOW_UP_CHARS = int(os.getenv("SHORT_FOLLOW_UP_CHARS", 120))
+
+def chat_task(messages):
+    follow_up = any(message["role"] == "assistant" for message in messages)
+    return "chat_short" if follow_up and len(messages[-1]["content"]) <= SHORT_FOLLOW_UP_CHARS else "chat"
+
+PREWARM_EXAMPLES = os.getenv("PREWARM_EXAMPLES", "1") == "1"
+# Off by default: speech is only loaded when a voice file is uploaded
+SPEECH_WARM_UP = os.getenv("SPEECH_WARM_UP", "0") == "1"
+CHAT_PARAMS = {"temperature": 0.7, "max_completion_tokens": 5000, "top_p": 0.9}
+
+EXAMPLE_PROMPTS = [
+    "What are some must-visit places in Japan during the Summer?",
+    "What are the best destinations for a budget-friendly trip in Europe?",
+    "Plan a four day trip to Scotland for a nature-loving family.",
+]
+
+# Streams the answers to the example prompts once at startup, so clicking an example is
+# answered from memory. Uses the same messages and parameters as chat_with_bot_stream.
+async def prewarm_examples(language="🇬🇧 English"):
+    async def prewarm(prompt):
+        history, _ = process_input([], {"text": prompt, "files": []})
+        messages = build_chat_messages(history, language)
+        try:
+            model = await model_router.prewarm(chat_task(messages), messages=messages, **CHAT_PARAMS)
+            log_event("prewarm", prompt=prompt, model=model)
+        except Exception as e:
+            log_event("prewarm_failed", prompt=prompt, error=repr(e))
+    await asyncio.gather(*(prewarm(prompt) for prompt in EXAMPLE_PROMPTS))
+
+# Only the session id and the new message come in, the history is read from the session store
+async def chat_with_bot_stream(user_input, audio, language, session_id):
+    new_request_id()
+    session_id = session_id or new_session_id()
+    history = await asyncio.to_thread(load_history, session_id)
+    saved_turns = len(history)
+    # Voice transcription blocks, keep it off the event loop
+    history, _ = await asyncio.to_thread(process_input, history, user_input)
 
-    # Add the inputs
-    if history[-1][1] == "":
-        messages.append({"role": "user", "content": history[-1][0]})
 
+    # Generate with the context, history
+    messages = build_chat_messages(history, language)
+    record_tokens("chat", tokens_in=prompt_tokens(messages))
+
+    started = time.perf_counter()
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            temperature=0.7,
-            max_completion_tokens=5000,
-            top_p=0.9,
-            stream=True
-        )
+        model, completion = await model_router.stream(chat_task(messages), messages=messages, **CHAT_PARAMS)
+        log_event("chat_model", model=model)
     except Exception as e:
-        return [("Tripper going offline, wait a second", "")]
+        metrics.inc("tripper_errors_total", stage="chat.llm", error=type(e).__name__)
+        log_event("chat_offline", error=repr(e))
+        yield history + [{"role": "assistant", "content": "Tripper going offline, wait a second"}], None
+        return
 
-    full_response = ""
-    for chunk in completion:
-        content = chunk.choices[0].delta.content or ""
-        full_response += content  
-        history[-1] = (history[-1][0], full_response)
-        # Filter the history start with "system" (the first one)
-        yield [(u, a) for u, a in history if u != "system"]
-    
+    # Speech is synthesized sentence by sentence in the background while the answer streams
+    worker = None
     if audio:
-        try:
-            history.append(("", "🔊Generating text-to-speech..."))
-            yield history
-
-            #Get chosen language 
-            language_map = {
-                "English": "en",
-                "Français": "fr",
-                "Español": "es",
-                "Deutsch": "de",
-                "Italiano": "it",
-                "日本語": "ja",
-                "中文": "zh"
-            }
-            tts_language = language_map.get(language, "en") #Defaults to english
-
-            audio_filename = f"bot_response_{int(time.time())}.mp3"
-            tts = gTTS(full_response, lang=tts_language)
-            tts.save(audio_filename)
-
-            # Insert the voice inside the chat
-            history.append(("", (audio_filename,)))  
-        except Exception as e:
-            print(f"TTS failed: {e}")
+        tts_language = tts_language_code(language)
+        sentences = asyncio.Queue()
+        segments = asyncio.Queue()
+        worker = asyncio.create_task(tts_worker(sentences, segments, tts_language))
+    spoken = 0
+    audio_segments = []
+
+    # Every update below only replaces the last message, so Gradio's streaming diff ships just
+    # its new text
+    history.append({"role": "assistant", "content": ""})
+    full_response = ""
+    try:
+        async for full_response in coalesce_stream(completion, "chat", started):
+            history[-1] = {"role": "assistant", "content": full_response}
+            if worker:
+                finished, consumed = split_sentences(full_response[spoken:])
+                spoken += consumed
+                for sentence in finished:
+                    sentences.put_nowait(sentence)
+                while not segments.empty():
+                    audio_segments.append(segments.get_nowait())
+                    yield history, audio_segments[-1]
+            yield history, None
+
+        if worker:
+            sentences.put_nowait(full_response[spoken:])
+            sentences.put_nowait(None)
+            while (segment := await segments.get()) is not None:
+                audio_segments.append(segment)
+                yield history, segment
+
+            if audio_segments:
+                # Keep the whole answer in the chat so it can be replayed. The file lives in
+                # the TTS cache, which may evict it later, so it is not stored with the session.
+                audio_filename = await asyncio.to_thread(tts_cache.put, full_response, tts_language, b"".join(audio_segments))
+                history.append({"role": "assistant", "content": {"path": audio_filename}})
+    finally:
+        if worker and not worker.done():
+            worker.cancel()
+        # Also keeps a partial answer when the user leaves mid-stream. Only this turn is
+        # appended, so another tab of the same session keeps its own turns.
+        await asyncio.to_thread(append_history, session_id, history[saved_turns:])
     # Make sure see the voice inside the chat bar
-    yield history 
+    yield history, None
+
+# Geocode cache settings
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join(CACHE_DIR, "geocode.sqlite3"))
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))   # Found places
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", 24 * 3600))  # Names that did not resolve
+GEOCODE_CACHE_MAX_ROWS = int(os.getenv("GEOCODE_CACHE_MAX_ROWS", 100000))
+GEOCODE_LRU_SIZE = int(os.getenv("GEOCODE_LRU_SIZE", 4096))
+
+# Two level cache for geocoding results: an in-process LRU in front of a SQLite file.
+# A value of None means the name was looked up before and did not resolve.
+class GeocodeCache:
+    def __init__(self, path, max_rows, lru_size):
+        self.max_rows = max_rows
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0}
+        self.path = path
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+
+    # Opened on first use, so processes that only import this module never touch the file
+    @property
+    def db(self):
+        with self._db_lock:
+            if self._db is None:
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS geocode ("
+                    "key TEXT PRIMARY KEY, lat REAL, lon REAL, expires_at REAL, last_used REAL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+                db.commit()
+                self._db = db
+            return self._db
+
+    @staticmethod
+    def make_key(location_name, context=None):
+        # Normalize case, spacing and list/markdown decorations so "  **Louvre** " == "louvre"
+        def normalize(text):
+            text = re.sub(r"^[\s\-\*\d\.\)#]+", "", text or "")
+            text = re.sub(r"[\*_`]", "", text)
+            return re.sub(r"\s+", " ", text).strip().lower()
+        return f"{normalize(location_name)}|{normalize(context)}"
+
+    # Returns (found, value); value is None for cached negative results
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            if key in self.lru:
+                value, expires_at = self.lru[key]
+                if expires_at > now:
+                    self.lru.move_to_end(key)
+                    self._count_hit(value)
+                    return True, value
+                del self.lru[key]
+
+            row = self.db.execute("SELECT lat, lon, expires_at FROM geocode WHERE key = ?", (key,)).fetchone()
+            if row and row[2] > now:
+                value = None if row[0] is None else [row[0], row[1]]
+                self.db.execute("UPDATE geocode SET last_used = ? WHERE key = ?", (now, key))
+                self.db.commit()
+                self._remember(key, value, row[2])
+                self._count_hit(value)
+                return True, value
+
+            self.stats["misses"] += 1
+            return False, None
+
+    def put(self, key, value):
+        now = time.time()
+        expires_at = now + (GEOCODE_CACHE_TTL if value else GEOCODE_NEGATIVE_TTL)
+        lat, lon = value if value else (None, None)
+        with self.lock:
+            self._remember(key, value, expires_at)
+            self.db.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lon, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lon, expires_at, now)
+            )
+            self._writes += 1
+            # Only check the table size every so often
+            if self._writes % 100 == 0:
+                self._evict(now)
+            self.db.commit()
+
+    # Names of places that resolved by destination (the key context), most recently used first
+    def known_names(self, limit):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT key FROM geocode WHERE lat IS NOT NULL ORDER BY last_used DESC LIMIT ?", (limit,)
+            ).fetchall()
+        names = {}
+        for (key,) in rows:
+            name, _, context = key.partition("|")
+            if len(name) >= 4:
+                names.setdefault(context, []).append(name)
+        return names
+
+    def _count_hit(self, value):
+        self.stats["hits" if value else "negative_hits"] += 1
+
+    def _remember(self, key, value, expires_at):
+        self.lru[key] = (value, expires_at)
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    # Drop expired rows, then the least recently used ones above max_rows
+    def _evict(self, now):
+        removed = self.db.execute("DELETE FROM geocode WHERE expires_at <= ?", (now,)).rowcount
+        (count,) = self.db.execute("SELECT COUNT(*) FROM geocode").fetchone()
+        if count > self.max_rows:
+            removed += self.db.execute(
+                "DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY last_used LIMIT ?)",
+                (count - self.max_rows,)
+            ).rowcount
+        self.stats["evictions"] += removed
+
+geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH, GEOCODE_CACHE_MAX_ROWS, GEOCODE_LRU_SIZE)
+
+# Live geocoding settings (Nominatim usage policy allows at most 1 request per second)
+GEOCODE_RATE = float(os.getenv("GEOCODE_RATE", 1))
+GEOCODE_BURST = int(os.getenv("GEOCODE_BURST", 1))
+GEOCODE_TIMEOUT = float(os.getenv("GEOCODE_TIMEOUT", 5))
+GEOCODE_RETRIES = int(os.getenv("GEOCODE_RETRIES", 2))
+GEOCODE_BACKOFF = float(os.getenv("GEOCODE_BACKOFF", 1))
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", 8))
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME", "https")
+MAP_RADIUS_KM = 500
+MAP_MAX_POINTS = int(os.getenv("MAP_MAX_POINTS", 25))
+# Offline GeoNames index, built with `python gazetteer.py build`; Nominatim is only asked for the names it misses
+GAZETTEER_DIR = os.getenv("GAZETTEER_DIR", os.path.join(CACHE_DIR, "gazetteer"))
+_gazetteer = None
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        from gazetteer import load_gazetteer
+        _gazetteer = load_gazetteer(GAZETTEER_DIR) or False
+    return _gazetteer
+
+# Token bucket shared by every thread that talks to the geocoding provider
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until a token is available; returns False if cancel_event was set while waiting
+    def acquire(self, cancel_event=None):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if cancel_event is None:
+                time.sleep(wait)
+            elif cancel_event.wait(wait):
+                return False
+
+geocode_rate_limiter = TokenBucket(GEOCODE_RATE, GEOCODE_BURST)
+geocode_pool = ThreadPoolExecutor(max_workers=GEOCODE_WORKERS, thread_name_prefix="geocode")
+
+class GeocodeCancelled(Exception):
+    pass
+
+_geolocator = None
+_geolocator_lock = threading.Lock()
+
+# One Nominatim client for every lookup, so its keep-alive connections are reused
+def get_geolocator():
+    global _geolocator
+    with _geolocator_lock:
+        if _geolocator is None:
+            from geopy.geocoders import Nominatim
+            _geolocator = Nominatim(
+                user_agent="trip-planner",  # Use your custom user agent
+                domain=NOMINATIM_DOMAIN,
+                scheme=NOMINATIM_SCHEME,
+                adapter_factory=geopy_adapter_factory("nominatim")
+            )
+        return _geolocator
+
+# One rate limited lookup with per-request timeout and exponential backoff on transient errors
+def _geocode_live(location_name, cancel_event=None):
+    from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited
+    geolocator = get_geolocator()
+    for attempt in range(GEOCODE_RETRIES + 1):
+        if not geocode_rate_limiter.acquire(cancel_event):
+            raise GeocodeCancelled(location_name)
+        try:
+            location = geolocator.geocode(location_name, timeout=GEOCODE_TIMEOUT)
+            return [location.latitude, location.longitude] if location else None
+        except (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited):
+            if attempt == GEOCODE_RETRIES:
+                raise
+            delay = GEOCODE_BACKOFF * 2 ** attempt
+            if cancel_event is not None and cancel_event.wait(delay):
+                raise GeocodeCancelled(location_name)
+            elif cancel_event is None:
+                time.sleep(delay)
 
 # Geocode function using Geopy
-def geocode_location(location_name):
-    geolocator = Nominatim(user_agent="trip-planner")  # Use your custom user agent
-    location = geolocator.geocode(location_name)
-    if location:
-        return [location.latitude, location.longitude], location_name  
+# context is the trip destination, so the same name in two cities gets two cache entries.
+# near is the destination's coordinates: gazetteer matches are limited to MAP_RADIUS_KM around it.
+def geocode_location(location_name, context=None, cancel_event=None, near=None):
+    gazetteer = get_gazetteer()
+    if gazetteer:
+        coord = gazetteer.lookup(location_name, near, MAP_RADIUS_KM)
+        if coord:
+            return coord, location_name
+
+    key = GeocodeCache.make_key(location_name, context)
+    found, coord = geocode_cache.get(key)
+    if not found:
+        with span("geocode.lookup"):
+            coord = _geocode_live(location_name, cancel_event)
+        geocode_cache.put(key, coord)
+
+    if coord:
+        return coord, location_name
     else:
         return None
 
+# Failed or cancelled lookups just leave the place off the map
+def _try_geocode(location_name, context=None, cancel_event=None, near=None):
+    try:
+        return geocode_location(location_name, context, cancel_event, near)
+    except GeocodeCancelled:
+        return None
+    except Exception as e:
+        record_error("geocode.lookup", e, place=location_name)
+        return None
+
+# Geocode a list of places concurrently, keeping their original order.
+# The first place that resolves is the reference point; once MAP_MAX_POINTS places
+# are known to be within MAP_RADIUS_KM of it, the remaining lookups are cancelled.
+def geocode_locations(location_list, destination=None):
+    coordinates = []
+    remaining = []
+    for i, location in enumerate(location_list):
+        coord = _try_geocode(location, destination)
+        if coord:
+            coordinates.append(coord)
+            remaining = location_list[i + 1:]
+            break
+    if not coordinates:
+        return []
+
+    reference = coordinates[0][0]
+    cancel_event = threading.Event()
+    # Copy the context per task so lookups log under the request id of this map
+    futures = {geocode_pool.submit(contextvars.copy_context().run, _try_geocode, location, destination, cancel_event, reference): i
+               for i, location in enumerate(remaining)}
+    results = {}
+    nearby = 1
+    for future in as_completed(futures):
+        coord = future.result()
+        if not coord:
+            continue
+        results[futures[future]] = coord
+        if haversine_km(reference, coord[0])[0] <= MAP_RADIUS_KM:
+            nearby += 1
+        if nearby >= MAP_MAX_POINTS:
+            cancel_event.set()
+            for pending in futures:
+                pending.cancel()
+            break
+
+    return coordinates + [results[i] for i in sorted(results)]
+
+EARTH_RADIUS_KM = 6371.0088
+MAP_CLUSTER_THRESHOLD = int(os.getenv("MAP_CLUSTER_THRESHOLD", 15))
+
+# Great-circle distance in km from origin to each (lat, lon) row of points, in one numpy pass
+def haversine_km(origin, points):
+    points = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    lat0, lon0 = np.radians(origin)
+    a = (np.sin((points[:, 0] - lat0) / 2) ** 2
+         + np.cos(lat0) * np.cos(points[:, 0]) * np.sin((points[:, 1] - lon0) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+# Leaflet page for the map. Only the marker data changes between maps, so the page is
+# split and escaped for the iframe once; each map only escapes its own JSON.
+MAP_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<link rel="stylesheet" href="https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.css">
+<link rel="stylesheet" href="https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.Default.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<script src="https://unpkg.com/leaflet.markercluster@1.5.3/dist/leaflet.markercluster.js"></script>
+<style>html, body, #map { height: 100%; margin: 0; }</style>
+</head><body><div id="map"></div><script>
+var data = __MAP_DATA__;
+var map = L.map("map").setView(data.center, 12);
+L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+  maxZoom: 19, attribution: "&copy; OpenStreetMap contributors"
+}).addTo(map);
+var layer = data.cluster ? L.markerClusterGroup() : L.layerGroup();
+data.markers.forEach(function (marker) {
+  // Tooltip appears on hover, set as text so names are never parsed as HTML
+  var label = document.createElement("span");
+  label.textContent = marker[2];
+  L.marker([marker[0], marker[1]]).bindTooltip(label).addTo(layer);
+});
+layer.addTo(map);
+</script></body></html>"""
+_map_page_head, _map_page_tail = MAP_PAGE.split("__MAP_DATA__")
+MAP_HTML_HEAD = (
+    '<div style="width:100%;"><div style="position:relative;width:100%;height:0;padding-bottom:60%;">'
+    '<iframe srcdoc="' + html.escape(_map_page_head)
+)
+MAP_HTML_TAIL = (
+    html.escape(_map_page_tail) + '" style="position:absolute;width:100%;height:100%;left:0;top:0;'
+    'border:none !important;" allowfullscreen></iframe></div></div>'
+)
+
+# Map HTML centered on center with one marker per (coord, name)
+def render_map(center, markers):
+    data = {
+        "center": [round(center[0], 5), round(center[1], 5)],
+        "cluster": len(markers) > MAP_CLUSTER_THRESHOLD,
+        "markers": [[round(coord[0], 5), round(coord[1], 5), name] for coord, name in markers],
+    }
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+    return MAP_HTML_HEAD + html.escape(payload) + MAP_HTML_TAIL
+
 def generate_map(locations):
+    ensure_request_id()
     # Split the string of locations into a list
-    location_list = locations.strip().split("\n")
+    location_list = [location for location in locations.strip().split("\n") if location.strip()]
     
     # Convert location names into latitudes and longitudes 
-    coordinates = []
-    for location in location_list:
-        coord = geocode_location(location)
-        if coord:
-          coordinates.append(coord)
+    destination = location_list[0] if location_list else None
+    with span("map.geocode", places=len(location_list)):
+        coordinates = geocode_locations(location_list, destination)
     
     # Check if any coordinates were found
     if len(coordinates) >= 2:
 
         #Filter out locations that are too far apart from the reference coordinate
-        filtered_coordinates = [coordinates[0]]
-        for coord in coordinates[1:]:
-            distance = geodesic(coordinates[0][0], coord[0]).km
-            if distance <= 500:
-                filtered_coordinates.append(coord)
-
-        if filtered_coordinates:
-            m = folium.Map(location=filtered_coordinates[0][0], zoom_start=12)
-
-            for coord, name in filtered_coordinates[1:]:
-                folium.Marker(
-                    location=coord,
-                    tooltip=name  # Tooltip appears on hover
-                ).add_to(m)
+        points = np.array([coord for coord, _ in coordinates])
+        nearby = haversine_km(points[0], points[1:]) <= MAP_RADIUS_KM
+        markers = [coord for coord, keep in zip(coordinates[1:], nearby) if keep]
+
+        with span("map.render", markers=len(markers)):
+            return render_map(coordinates[0][0], markers)
+
+# Map settings for plans that are still streaming: how often new places are looked for,
+# and how many lookups a plan may start before its final place list is known
+MAP_UPDATE_INTERVAL = float(os.getenv("MAP_UPDATE_INTERVAL", 1.0))
+MAP_MAX_LOOKUPS = int(os.getenv("MAP_MAX_LOOKUPS", 2 * MAP_MAX_POINTS))
+
+# A map built up while a plan streams. Places mentioned so far are found with the local place
+# extractor and geocoded in the background; update() renders the map whenever new markers
+# resolved. finish() then only has to wait for the places of the final list not seen yet.
+class ProgressiveMap:
+    def __init__(self, destination=None):
+        self.destination = None
+        self.reference = None        # Future of the destination lookup
+        self.lookups = {}            # Place name -> Future of its lookup
+        self.cancels = {}            # Place name -> Event that drops its lookup
+        self.names = []              # Place names in order of first mention
+        self.cancel_event = threading.Event()
+        self.rendered = -1           # Markers on the last rendered map
+        if destination and destination.strip():
+            self.set_destination(destination.strip())
+
+    def submit(self, *args):
+        return geocode_pool.submit(contextvars.copy_context().run, _try_geocode, *args)
+
+    def set_destination(self, destination):
+        if self.destination is None:
+            self.destination = destination
+            self.reference = self.submit(destination, destination, self.cancel_event)
+
+    def reference_coord(self):
+        if self.reference is not None and self.reference.done() and self.reference.result():
+            return self.reference.result()[0]
+        return None
 
-            return m._repr_html_()
+    def add(self, names, limit=MAP_MAX_LOOKUPS):
+        for name in names:
+            if name not in self.names:
+                self.names.append(name)
+        near = self.reference_coord()
+        if near is None:
+            return
+        for name in self.names:
+            if name not in self.lookups and len(self.lookups) < limit:
+                self.cancels[name] = threading.Event()
+                self.lookups[name] = self.submit(name, self.destination, self.cancels[name], near)
+
+    # Resolved places among names within MAP_RADIUS_KM of the destination, at most MAP_MAX_POINTS
+    def markers(self, names):
+        found = []
+        for name in names:
+            future = self.lookups.get(name)
+            if future is not None and future.done() and not future.cancelled() and future.result():
+                found.append(future.result())
+        if not found:
+            return []
+        nearby = haversine_km(self.reference_coord(), np.array([coord for coord, _ in found])) <= MAP_RADIUS_KM
+        return [place for place, keep in zip(found, nearby) if keep][:MAP_MAX_POINTS]
+
+    # Map HTML when it changed since the last update, else None
+    def update(self, text):
+        found, names = get_place_extractor().extract(text, self.destination)
+        if found:
+            self.set_destination(found)
+        self.add(names)
+        near = self.reference_coord()
+        if near is None:
+            return None
+        markers = self.markers(self.names)
+        if len(markers) == self.rendered:
+            return None
+        self.rendered = len(markers)
+        return render_map(near, markers)
+
+    # Map for the final places list (destination first), like generate_map
+    def finish(self, places):
+        names = [name for name in places.strip().split("\n") if name.strip()]
+        if not names:
+            return None
+        self.set_destination(names[0])
+        self.reference.result()
+        if self.reference_coord() is None:
+            return generate_map(places)
+        # Lookups of streamed names that are not in the final list are dropped, so they stop
+        # taking rate limiter tokens from the ones waited for
+        for name in set(self.lookups) - set(names[1:]):
+            self.drop(name)
+        # The final places are always looked up, whatever the streaming lookups used of the limit
+        self.names = [name for name in self.names if name in names[1:]]
+        self.add(names[1:], limit=len(self.lookups) + len(names))
+        wait([self.lookups[name] for name in names[1:] if name in self.lookups])
+        markers = self.markers(names[1:])
+        if not markers:
+            return None
+        with span("map.render", markers=len(markers)):
+            return render_map(self.reference_coord(), markers)
+
+    # A queued lookup never starts; one waiting for the rate limiter gives up
+    def drop(self, name):
+        self.cancels[name].set()
+        self.lookups[name].cancel()
+
+    # Lookups still queued for places that did not make it into the plan are dropped
+    def close(self):
+        self.cancel_event.set()
+        for name in self.lookups:
+            self.drop(name)
+
+# Map for a planner result, reusing the one stored with a cached plan
+def generate_plan_map(locations, cache_key=None):
+    cached_map = plan_cache.get_map(cache_key) if cache_key else None
+    if cached_map:
+        return cached_map
+    map_html = generate_map(locations)
+    if cache_key and map_html:
+        plan_cache.set_map(cache_key, map_html)
+    return map_html
+
+# Local place extraction (see place_extractor.py). The dictionary is every place geocoded
+# before, by destination, and is rebuilt every PLACE_DICTIONARY_TTL seconds. Its places are
+# used when at least PLACE_EXTRACT_CONFIDENCE of them are in the dictionary or the gazetteer.
+PLACE_EXTRACT_CONFIDENCE = float(os.getenv("PLACE_EXTRACT_CONFIDENCE", 0.6))
+PLACE_DICTIONARY_SIZE = int(os.getenv("PLACE_DICTIONARY_SIZE", 50000))
+PLACE_DICTIONARY_TTL = int(os.getenv("PLACE_DICTIONARY_TTL", 600))
+_place_extractor = None
+_place_extractor_built = 0
+_place_extractor_lock = threading.Lock()
+
+def build_place_extractor():
+    global _place_extractor
+    from place_extractor import PlaceExtractor
+    gazetteer = get_gazetteer()
+    _place_extractor = PlaceExtractor(geocode_cache.known_names(PLACE_DICTIONARY_SIZE), gazetteer.knows if gazetteer else None)
+    return _place_extractor
+
+# Built on first use, then rebuilt in the background while the old one keeps serving
+def get_place_extractor():
+    global _place_extractor_built
+    with _place_extractor_lock:
+        if _place_extractor is None:
+            _place_extractor_built = time.monotonic()
+            return build_place_extractor()
+        if time.monotonic() - _place_extractor_built > PLACE_DICTIONARY_TTL:
+            _place_extractor_built = time.monotonic()
+            threading.Thread(target=build_place_extractor, name="place-dictionary", daemon=True).start()
+    return _place_extractor
 
 #Extract names of places in trip plan
-def extract_places(trip_text):
-    response = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-              {"role": "system", "content": "Extract the names of places (museums, hotels, restaurants, attractions) from this itinerary. Just print the names, no other formatting or words. Put the name of the destination (city) on the first line."},
-              {"role": "user", "content": trip_text}
-          ],
-        temperature=0,
-        max_completion_tokens=5000,
-        top_p=1
-    )
+# Tries the local extractor first; the LLM is only asked when it finds no destination or
+# too few of its places can be verified
+def extract_places_locally(trip_text, destination=None):
+    extractor = get_place_extractor()
+    found, names = extractor.extract(trip_text, destination)
+    return found, names, extractor.confidence(found, names)
+
+async def extract_places(trip_text, destination=None):
+    with span("plan.extract_places") as fields:
+        found, names, confidence = await asyncio.to_thread(extract_places_locally, trip_text, destination)
+        fields["confidence"] = round(confidence, 2)
+        if found and names and confidence >= PLACE_EXTRACT_CONFIDENCE:
+            fields["method"] = "local"
+            metrics.inc("tripper_place_extraction_total", method="local")
+            return "\n".join([found] + names)
+        fields["method"] = "llm"
+        metrics.inc("tripper_place_extraction_total", method="llm")
+        try:
+            fields["model"], response = await model_router.complete(
+                "extract_places",
+                messages=[
+                      {"role": "system", "content": "Extract the names of places (museums, hotels, restaurants, attractions) from this itinerary. Just print the names, no other formatting or words. Put the name of the destination (city) on the first line."},
+                      {"role": "user", "content": trip_text}
+                  ],
+                temperature=0,
+                max_completion_tokens=5000,
+                top_p=1
+            )
+        except Exception as e:
+            # The plan is already on screen: keep whatever the local extractor found
+            record_error("plan.extract_places", e)
+            fields["method"] = "local_fallback"
+            return "\n".join([found] + names) if found and names else ""
+    record_usage("extract_places", response.usage)
 
     return response.choices[0].message.content.strip()
 
-#Creates a markdown file with plan_text
-def save_plan_to_file(plan_text):
-    global plan_num
-    filename = f"trip_plan_{plan_num}.md"
-    plan_num += 1
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(plan_text)
-    
-    return filename
+# Plan file store settings
+PLAN_DIR = os.path.join(CACHE_DIR, "plans")
+PLAN_FILE_TTL = int(os.getenv("PLAN_FILE_TTL", 24 * 3600))
+PLAN_DISK_QUOTA = int(float(os.getenv("PLAN_DISK_QUOTA_MB", 100)) * 1024 * 1024)
+PLAN_CLEANUP_INTERVAL = int(os.getenv("PLAN_CLEANUP_INTERVAL", 600))
+
+# Downloadable plan files, one directory per session. Files are named after a hash of
+# their content, so saving the same plan twice reuses the file. A background thread drops
+# files older than the TTL and keeps the whole store under the disk quota.
+class PlanStore:
+    def __init__(self, directory, ttl, quota, interval):
+        self.directory = directory
+        self.ttl = ttl
+        self.quota = quota
+        self.interval = interval
+        self.cleanup_thread = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def session_dir(self, session_id):
+        session_id = re.sub(r"[^A-Za-z0-9_-]", "", session_id or "") or "shared"
+        return os.path.join(self.directory, session_id)
+
+    def save(self, plan_text, session_id=None):
+        self.start_cleanup()
+        data = plan_text.encode("utf-8")
+        directory = self.session_dir(session_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trip_plan_{hashlib.sha256(data).hexdigest()[:12]}.md")
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            atomic_write(path, data)
+        return path
+
+    def cleanup(self):
+        expires = time.time() - self.ttl
+        for root, dirs, files in os.walk(self.directory, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < expires:
+                        os.remove(path)
+                except OSError:
+                    pass
+            if root != self.directory and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+        evict_to_size(self.directory, self.quota)
+
+    def start_cleanup(self):
+        with self.lock:
+            if self.cleanup_thread is not None:
+                return
+            self.cleanup_thread = threading.Thread(target=self._cleanup_loop, name="plan-cleanup", daemon=True)
+            self.cleanup_thread.start()
+
+    def _cleanup_loop(self):
+        while True:
+            try:
+                self.cleanup()
+            except Exception as e:
+                record_error("plan.cleanup", e)
+            time.sleep(self.interval)
+
+plan_store = PlanStore(PLAN_DIR, PLAN_FILE_TTL, PLAN_DISK_QUOTA, PLAN_CLEANUP_INTERVAL)
+
+#Creates a markdown file with plan_text for the download button
+def save_plan_to_file(plan_text, session_id=None):
+    with span("plan.save_file"):
+        path = plan_store.save(plan_text, session_id)
+    return gr.update(visible=True, value=path)
+
+# generate_plan for the UI: the download file is saved as soon as the plan text is complete
+# (generate_plan then sets its key), not after the map
+async def generate_plan_with_file(details, destination, interests, num_days, budget, time_period, num_people_slider, currency, language, regenerate=False, session_id=None):
+    saved = False
+    async for plan_text, places, error, cache_key, map_html in generate_plan(details, destination, interests, num_days, budget, time_period, num_people_slider, currency, language, regenerate, session_id):
+        download = gr.skip()
+        if cache_key and not saved:
+            saved = True
+            download = await asyncio.to_thread(save_plan_to_file, plan_text, session_id)
+        yield plan_text, places, error, cache_key, map_html, download
+
+# Session state: chat history and the last plan by session id (see sessions.py)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(CACHE_DIR, "sessions.sqlite3"))
+SESSION_SECRET = os.getenv("SESSION_SECRET")  # Must be the same on every worker
+session_store = open_session_store(SESSION_STORE, SESSION_DB_PATH)
+
+# Chat history in Gradio's messages format. Only text messages are stored, the last
+# SESSION_HISTORY_MESSAGES of them; older turns live on in the conversation summaries.
+SESSION_HISTORY_MESSAGES = int(os.getenv("SESSION_HISTORY_MESSAGES", 40))
+
+# Sessions written before the messages format held [user, answer] pairs, which are skipped
+def load_history(session_id):
+    return [message for message in session_store.get(session_id, "history", []) if isinstance(message, dict)]
+
+def append_history(session_id, messages):
+    messages = [message for message in messages if isinstance(message["content"], str) and message["content"]]
+    if messages:
+        session_store.append(session_id, "history", messages, limit=SESSION_HISTORY_MESSAGES)
+
+def save_session_plan(session_id, plan_text, places, cache_key):
+    if session_id:
+        session_store.set(session_id, "plan", {"text": plan_text, "places": places, "key": cache_key})
+
+def clear_session_plan(session_id):
+    if session_id:
+        session_store.set(session_id, "plan", {})
+
+# First step of every chat and plan event: an event that starts before the page load handed
+# out an id gets one here, sent back to the browser so the session can be restored later
+def ensure_session(session_id):
+    return session_id if valid_session_id(session_id) else new_session_id()
+
+# On page load: hands out a session id on the first visit, restores the chat and plan afterwards
+def restore_session(session_id):
+    if not valid_session_id(session_id):
+        session_id = new_session_id()
+    plan = session_store.get(session_id, "plan") or {}
+    map_html = plan_cache.get_map(plan["key"]) if plan.get("key") else None
+    return session_id, load_history(session_id), plan.get("text", ""), plan.get("places", ""), plan.get("key"), map_html or ""
 
 #Title animation - https://www.gradio.app/guides/custom-CSS-and-JS
 js_animate = """
@@ -341,7 +1596,6 @@ function toggleTheme() {
 
 """
 
-conversation_history = []
 TITLE="""
 <h1>✈️ Travel Assistant</h1>
 <h3 class="subtitle">Discuss your travel plans and find out about your destination with our travel chatbot!</hh3>
@@ -519,9 +1773,6 @@ CURRENCY_MAP = {
   "AUD": ("A$", 100, 28000),
 }
 
-global plan_num
-plan_num = 1
-
 #Create custom theme colors
 custom_theme = gr.themes.Default(primary_hue="blue", secondary_hue="blue")
 
@@ -530,152 +1781,249 @@ def update_budget_slider(currency):
   symbol, min_val, max_val = CURRENCY_MAP[currency]
   return gr.update(label=f"Budget ({symbol}) (optional)", minimum=min_val, maximum=max_val)
 
-with gr.Blocks(js=js_animate, theme=custom_theme) as demo:
-    gr.HTML(STYLE)
-
-    with gr.Row(elem_id="language-container"):
-        language_dropdown = gr.Dropdown(choices=[
-            "🇬🇧 English", 
-            "🇫🇷 Français", 
-            "🇪🇸 Español", 
-            "🇩🇪 Deutsch", 
-            "🇮🇹 Italiano", 
-            "🇯🇵 日本語", 
-            "🇨🇳 中文"
-        ], value="🇬🇧 English", label="Language", elem_id="language-dropdown", container=False, scale=8)
-
-        #Theme toggle button
-        theme_toggle = gr.Button("☼", elem_id="theme-toggle-btn", scale=2)
-        theme_toggle.click(
-            fn=lambda: None,
-            inputs=[],
-            outputs=[],
-            js=js_theme
-        )
-
-    with gr.Tabs():
-
-      with gr.TabItem("💬 Chat"):
-        gr.HTML(TITLE)
-
-        chatbot = gr.Chatbot(label="Travel Assistant Chatbot", elem_id="chatbot")
+# The UI is built on demand rather than at import, so speech worker processes, the batch
+# CLI and the benchmark can import this module without paying for it
+def build_demo():
+    global STARTUP_SECONDS
+    with gr.Blocks() as demo:
+        gr.HTML(STYLE)
+        # Only the id lives in the browser, everything else is in the session store
+        session_id = gr.BrowserState(None, storage_key="tripper_session", secret=SESSION_SECRET)
+
+        with gr.Row(elem_id="language-container"):
+            language_dropdown = gr.Dropdown(choices=[
+                "🇬🇧 English", 
+                "🇫🇷 Français", 
+                "🇪🇸 Español", 
+                "🇩🇪 Deutsch", 
+                "🇮🇹 Italiano", 
+                "🇯🇵 日本語", 
+                "🇨🇳 中文"
+            ], value="🇬🇧 English", label="Language", elem_id="language-dropdown", container=False, scale=8)
+
+            #Theme toggle button
+            theme_toggle = gr.Button("☼", elem_id="theme-toggle-btn", scale=2)
+            theme_toggle.click(
+                fn=lambda: None,
+                inputs=[],
+                outputs=[],
+                js=js_theme
+            )
+
+        with gr.Tabs():
+
+          with gr.TabItem("💬 Chat"):
+            gr.HTML(TITLE)
+
+            chatbot = gr.Chatbot(label="Travel Assistant Chatbot", elem_id="chatbot")
         
-        user_input = gr.MultimodalTextbox(
-            interactive=True,
-            file_count="multiple",
-            placeholder="Enter your message or upload talk to Tripper...",
-            show_label=False,
-            sources=["microphone"], 
-        )
+            user_input = gr.MultimodalTextbox(
+                interactive=True,
+                file_count="multiple",
+                placeholder="Enter your message or upload talk to Tripper...",
+                show_label=False,
+                sources=["microphone"], 
+            )
         
-        audio_button = gr.Checkbox(value=False, elem_id="checkbox", container=False, label="Enable Text-to-Speech")
-        gr.Examples(examples=['What are some must-visit places in Japan during the Summer?',
-                              'What are the best destinations for a budget-friendly trip in Europe?',
-                              'Plan a four day trip to Scotland for a nature-loving family.'],
-                    inputs=user_input, label="Examples")
+            audio_button = gr.Checkbox(value=False, elem_id="checkbox", container=False, label="Enable Text-to-Speech")
+            # Spoken answer, streamed sentence by sentence
+            tts_output = gr.Audio(streaming=True, autoplay=True, visible=False, label="Tripper voice", elem_id="tts-audio")
+            audio_button.change(fn=lambda enabled: gr.update(visible=enabled), inputs=audio_button, outputs=tts_output)
+            gr.Examples(examples=EXAMPLE_PROMPTS, inputs=user_input, label="Examples")
                 
-        # Process text + voice
-        chat_msg = user_input.submit(
-            fn=lambda _: gr.update(interactive=False, submit_btn=False),  
-            inputs=[],
-            outputs=user_input
-        ).then(
-            fn=chat_with_bot_stream,
-            inputs=[user_input, audio_button, language_dropdown, chatbot],
-            outputs=chatbot,
-            api_name="bot_response"
-        ).then(
-            fn=lambda _: "",
-            inputs=None,
-            outputs=user_input
-        ).then(
-            fn=lambda _: gr.update(interactive=True, submit_btn=True),  
-            inputs=[],
-            outputs=user_input
-        )
-
-
-      #Trip planner section
-      with gr.TabItem("🌍 Trip Planner"):
-        gr.HTML(PLAN_TITLE)
-        with gr.Row():
-          with gr.Column():
-            details_input = gr.Textbox(label="📝 Trip Details")
-            destination_input = gr.Textbox(label="📍 Destination (optional)", placeholder="Enter your destination")
-            interests_input = gr.Textbox(label="🎯 Interests (optional)", placeholder="E.g., hiking, food, museums")
-
-          with gr.Column():
-            num_days_slider = gr.Slider(minimum=1, maximum=30, step=1, value=None, label="📅 Number of Days (optional)", interactive=True)
+            # Process text + voice
+            chat_msg = user_input.submit(
+                fn=lambda _: gr.update(interactive=False, submit_btn=False),  
+                inputs=[],
+                outputs=user_input
+            ).then(
+                fn=ensure_session,
+                inputs=[session_id],
+                outputs=[session_id]
+            ).then(
+                fn=chat_with_bot_stream,
+                inputs=[user_input, audio_button, language_dropdown, session_id],
+                outputs=[chatbot, tts_output],
+                api_name="bot_response",
+                concurrency_limit=CHAT_CONCURRENCY,
+                concurrency_id="chat"
+            ).then(
+                fn=lambda _: "",
+                inputs=None,
+                outputs=user_input
+            ).then(
+                fn=lambda _: gr.update(interactive=True, submit_btn=True),  
+                inputs=[],
+                outputs=user_input
+            )
+
+
+          #Trip planner section
+          with gr.TabItem("🌍 Trip Planner"):
+            gr.HTML(PLAN_TITLE)
             with gr.Row():
-              #Dropdown to select currency for budget
-              currency_dropdown = gr.Dropdown(
-                choices=list(CURRENCY_MAP.keys()),
-                value="USD",
-                show_label=False,
-                scale=2
-              )
-              budget_slider = gr.Slider(minimum=100, maximum=30000, step=100, value=None, label="💰 Budget ($) (optional)", interactive=True, scale=8)
-              currency_dropdown.change(update_budget_slider, inputs=[currency_dropdown], outputs=[budget_slider])
-
-            num_people_slider = gr.Slider(minimum=1, maximum=10, step=1, value=None, label="👨‍👩‍👧 Number of People (optional)", interactive=True)
-            time_period = gr.Textbox(label="🕒 Time Period (optional)", placeholder="E.g., Summer, December, Christmas, 2025-07-10")
-
-        generate_btn = gr.Button("Generate Plan", elem_id="send-button")
-        clear_plan = gr.Button("Reset", elem_id="send-button")
-
-        error_output = gr.Markdown()
-        plan_output = gr.Markdown(label="Plan")
-        map_output = gr.HTML("")
-        places = gr.Textbox(visible=False)
-        download_button = gr.DownloadButton("Download", visible=False, elem_id="download-button")
-
-        generate_btn.click(
-            fn=lambda *args: ("**Generating trip plan...**", "", "", gr.update(visible=False)),  
-            inputs=[],
-            outputs=[plan_output, map_output, error_output, download_button]
-        ).then(
-            fn=generate_plan,
-            inputs=[details_input, destination_input, interests_input, num_days_slider, budget_slider, time_period, num_people_slider, currency_dropdown, language_dropdown],
-            outputs=[plan_output, places, error_output]  
-        ).then(
-            fn=lambda plan_text: gr.update(visible=True, value=save_plan_to_file(plan_text)),
-            inputs=[plan_output],
-            outputs=[download_button]
-        ).then(
-            fn=lambda *args: ("Generating map..."),  
-            inputs=[],
-            outputs=map_output
-        ).then(
-            fn=generate_map,
-            inputs=places,  
-            outputs=map_output
+              with gr.Column():
+                details_input = gr.Textbox(label="📝 Trip Details")
+                destination_input = gr.Textbox(label="📍 Destination (optional)", placeholder="Enter your destination")
+                interests_input = gr.Textbox(label="🎯 Interests (optional)", placeholder="E.g., hiking, food, museums")
+
+              with gr.Column():
+                num_days_slider = gr.Slider(minimum=1, maximum=30, step=1, value=None, label="📅 Number of Days (optional)", interactive=True)
+                with gr.Row():
+                  #Dropdown to select currency for budget
+                  currency_dropdown = gr.Dropdown(
+                    choices=list(CURRENCY_MAP.keys()),
+                    value="USD",
+                    show_label=False,
+                    scale=2
+                  )
+                  budget_slider = gr.Slider(minimum=100, maximum=30000, step=100, value=None, label="💰 Budget ($) (optional)", interactive=True, scale=8)
+                  currency_dropdown.change(update_budget_slider, inputs=[currency_dropdown], outputs=[budget_slider])
+
+                num_people_slider = gr.Slider(minimum=1, maximum=10, step=1, value=None, label="👨‍👩‍👧 Number of People (optional)", interactive=True)
+                time_period = gr.Textbox(label="🕒 Time Period (optional)", placeholder="E.g., Summer, December, Christmas, 2025-07-10")
+
+            regenerate_checkbox = gr.Checkbox(value=False, label="Regenerate (skip saved plans)", container=False)
+            generate_btn = gr.Button("Generate Plan", elem_id="send-button")
+            clear_plan = gr.Button("Reset", elem_id="send-button")
+
+            error_output = gr.Markdown()
+            plan_output = gr.Markdown(label="Plan")
+            map_output = gr.HTML("")
+            places = gr.Textbox(visible=False)
+            plan_key = gr.State(None)
+            download_button = gr.DownloadButton("Download", visible=False, elem_id="download-button")
+
+            generate_btn.click(
+                fn=lambda *args: ("**Generating trip plan...**", "", "", gr.update(visible=False)),  
+                inputs=[],
+                outputs=[plan_output, map_output, error_output, download_button]
+            ).then(
+                fn=ensure_session,
+                inputs=[session_id],
+                outputs=[session_id]
+            ).then(
+                fn=generate_plan_with_file,
+                inputs=[details_input, destination_input, interests_input, num_days_slider, budget_slider, time_period, num_people_slider, currency_dropdown, language_dropdown, regenerate_checkbox, session_id],
+                outputs=[plan_output, places, error_output, plan_key, map_output, download_button],
+                concurrency_limit=PLAN_CONCURRENCY,
+                concurrency_id="plan"
+            )
+
+            clear_plan.click(
+                fn=lambda: ("", "", "", None, None, "", None, "USD", "", "", "", gr.update(visible=False)),
+                inputs=[],
+                outputs=[
+                    details_input,
+                    destination_input,
+                    interests_input,
+                    num_days_slider,
+                    budget_slider,
+                    time_period,
+                    num_people_slider,
+                    currency_dropdown,
+                    plan_output,
+                    map_output,
+                    error_output,
+                    download_button
+                ]
+            ).then(
+                fn=update_budget_slider,
+                inputs=[currency_dropdown],  
+                outputs=[budget_slider]
+            ).then(
+                fn=lambda: (None),
+                inputs=[],
+                outputs=[budget_slider]
+            ).then(
+                fn=clear_session_plan,
+                inputs=[session_id],
+                outputs=None
+            )
+
+        # Sessions outlive the tab, old plan files are removed by the plan store's TTL instead
+        demo.load(
+            fn=restore_session,
+            inputs=[session_id],
+            outputs=[session_id, chatbot, plan_output, places, plan_key, map_output]
         )
 
-        clear_plan.click(
-            fn=lambda: ("", "", "", None, None, "", None, "USD", "", "", "", gr.update(visible=False)),
-            inputs=[],
-            outputs=[
-                details_input,
-                destination_input,
-                interests_input,
-                num_days_slider,
-                budget_slider,
-                time_period,
-                num_people_slider,
-                currency_dropdown,
-                plan_output,
-                map_output,
-                error_output,
-                download_button
-            ]
-        ).then(
-            fn=update_budget_slider,
-            inputs=[currency_dropdown],  
-            outputs=[budget_slider]
-        ).then(
-            fn=lambda: (None),
-            inputs=[],
-            outputs=[budget_slider]
-        )
-
-demo.launch()
\ No newline at end of file
+    demo.queue(default_concurrency_limit=DEFAULT_CONCURRENCY, max_size=QUEUE_MAX_SIZE)
+    # Time from the first line of this module to a built UI: the cold start cost benchmark.py tracks
+    STARTUP_SECONDS = time.perf_counter() - _import_started
+    return demo
+
+# Cache counters, read when /metrics is scraped
+metrics.describe("tripper_cache_events", "Cache events (hits, misses, evictions...) by cache since start", kind="counter")
+
+def cache_metrics():
+    caches = [("geocode", geocode_cache.stats), ("plan", plan_cache.stats), ("tts", tts_cache.stats)]
+    if _gazetteer:
+        caches.append(("gazetteer", _gazetteer.stats))
+    for cache_name, stats in caches:
+        for event, value in list(stats.items()):
+            yield "tripper_cache_events", {"cache": cache_name, "event": event}, value
+
+metrics.register_collector(lambda: list(cache_metrics()))
+metrics.register_collector(model_router.collect)
+metrics.register_collector(http_clients.collect)
+
+STARTUP_SECONDS = None
+metrics.register_collector(lambda: [("tripper_startup_seconds", {}, round(STARTUP_SECONDS, 3))] if STARTUP_SECONDS else [])
+
+# Guarded so speech worker processes can import this module without starting a server
+if __name__ == "__main__":
+    import uvicorn
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(message)s")
+    demo = build_demo()
+    log_event("startup", seconds=round(STARTUP_SECONDS, 3))
+
+    # Waits until the server is up, so the worker processes do not slow the start down.
+    # A failed warm-up is only logged; the pool is started again on the first upload.
+    async def warm_up_speech():
+        while not uvicorn_server.started:
+            await asyncio.sleep(0.5)
+        try:
+            import speech
+            workers = await asyncio.to_thread(speech.warm_up)
+            log_event("speech_warm_up", workers=workers)
+        except Exception as e:
+            record_error("speech.warm_up", e)
+
+    @asynccontextmanager
+    async def lifespan(_):
+        # In the background, the UI does not wait for the example answers
+        prewarm_task = asyncio.create_task(prewarm_examples()) if PREWARM_EXAMPLES else None
+        # Starts the speech worker processes instead of on the first multi-file upload
+        speech_task = asyncio.create_task(warm_up_speech()) if SPEECH_WARM_UP else None
+        yield
+        if speech_task:
+            speech_task.cancel()
+        if prewarm_task:
+            prewarm_task.cancel()
+
+    # Gradio is mounted under a FastAPI app so /metrics can sit next to it
+    server = FastAPI(lifespan=lifespan)
+
+    @server.get("/metrics")
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    # Only the audio and plan download directories are served, never the rest of the cache,
+    # and the databases are blocked whatever the allowed paths cover. Gradio 6 takes the
+    # theme and js where the app is launched, here where it is mounted.
+    private_paths = [os.path.abspath(path + suffix) for path in (SESSION_DB_PATH, GEOCODE_CACHE_PATH) for suffix in ("", "-wal", "-shm", "-journal")]
+    server = gr.mount_gradio_app(
+        server, demo, path="/", allowed_paths=[TTS_CACHE_DIR, PLAN_DIR], blocked_paths=private_paths,
+        theme=custom_theme, js=js_animate
+    )
+    uvicorn_server = uvicorn.Server(uvicorn.Config(
+        server,
+        host=os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"),
+        port=int(os.getenv("GRADIO_SERVER_PORT", 7860))
+    ))
+    uvicorn_server.run()
\ No newline at end of file
@@ -0,0 +1,191 @@
+#Batch trip plan generation
+#
+#Reads rows of planner parameters from a JSONL or CSV file and runs each one through the
+#same generate_plan path (plan, places and map) as the Trip Planner tab, several at a time.
+#
+#   python batch_plans.py rows.jsonl --output plans.jsonl --concurrency 8 --requests-per-minute 30
+#   python batch_plans.py rows.csv --output plans.jsonl --no-maps
+#
+#Row fields (all optional except one of destination/details): id, details, destination,
+#interests, num_days, budget, time_period, num_people, currency, language.
+#
+#Each finished row is appended to the output as one JSON line with its plan, places and map
+#HTML. The output doubles as the checkpoint: rerunning the same command skips rows that
+#already have an "ok" line, so a crashed run picks up where it stopped.
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+FIELDS = ["details", "destination", "interests", "num_days", "budget", "time_period", "num_people", "currency", "language"]
+DEFAULTS = {"details": "", "destination": "", "interests": "", "num_days": 1, "budget": 0, "time_period": "",
+            "num_people": 1, "currency": "USD", "language": "🇬🇧 English"}
+
+def read_rows(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [normalize_row(row) for row in rows]
+
+#Fills in defaults and converts CSV strings to numbers. Rows without an id get one from
+#their parameters, so the same row keeps its id across runs.
+def normalize_row(row):
+    params = dict(DEFAULTS)
+    for field in FIELDS:
+        value = row.get(field)
+        if value not in (None, ""):
+            params[field] = value
+    params["num_days"] = int(float(params["num_days"]))
+    params["num_people"] = int(float(params["num_people"]))
+    # Whole budgets stay ints so the prompt says "1000 USD" like the planner tab, not "1000.0 USD"
+    budget = float(params["budget"])
+    params["budget"] = int(budget) if budget.is_integer() else budget
+    row_id = str(row.get("id") or "") or hashlib.sha1(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return row_id, params
+
+def finished_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Half written line from a crash
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+#Spaces out Groq calls to at most rate per second, with bursts of up to burst calls
+class AsyncTokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+#Appends one JSON line per record and flushes it to disk right away
+class OutputWriter:
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = asyncio.Lock()
+
+    async def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        async with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+#Runs one row through generate_plan; map_html stays None when with_map is off or no map could be made
+async def plan_row(app, params, regenerate, with_map):
+    plan, places, error, map_html = "", "", "", None
+    async for plan, places, error, _, map_update in app.generate_plan(
+        params["details"], params["destination"], params["interests"], params["num_days"], params["budget"],
+        params["time_period"], params["num_people"], params["currency"], params["language"], regenerate,
+        None, with_map
+    ):
+        if isinstance(map_update, str) or map_update is None:
+            map_html = map_update or None
+    return plan, places, error, map_html
+
+async def run_row(app, row_id, params, args, semaphore, writer, progress):
+    async with semaphore:
+        started = time.perf_counter()
+        record = {"id": row_id, "params": params}
+        for attempt in range(args.retries + 1):
+            try:
+                plan, places, error, map_html = await plan_row(app, params, args.regenerate, args.maps)
+            except Exception as e:
+                plan, places, error, map_html = "", "", repr(e), None
+            if plan and not error:
+                break
+            if attempt < args.retries:
+                await asyncio.sleep(args.retry_delay * 2 ** attempt)
+
+        if plan and not error:
+            record.update(status="ok", plan=plan, places=places, map_html=map_html)
+        else:
+            record.update(status="error", error=error or "empty plan")
+        record["seconds"] = round(time.perf_counter() - started, 2)
+        await writer.write(record)
+
+        progress["done"] += 1
+        print(f"[{progress['done']}/{progress['total']}] {row_id} {record['status']} {record['seconds']}s", flush=True)
+        return record["status"] == "ok"
+
+async def run(args, rows):
+    import app
+
+    # Every Groq request takes a token: plans, place extraction, translations and failovers.
+    # No hedging, a request waiting for its token would look slow and start another one.
+    limiter = AsyncTokenBucket(args.requests_per_minute / 60, args.burst)
+    app.model_router.before_request = limiter.acquire
+    app.model_router.max_hedges = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    writer = OutputWriter(args.output)
+    progress = {"done": 0, "total": len(rows)}
+    try:
+        results = await asyncio.gather(*(run_row(app, row_id, params, args, semaphore, writer, progress) for row_id, params in rows))
+    finally:
+        writer.close()
+    return sum(results), len(results) - sum(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate trip plans in bulk")
+    parser.add_argument("input", help="JSONL or CSV file of planner parameters")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to; also the checkpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="plans generated at the same time")
+    parser.add_argument("--requests-per-minute", type=float, default=30, help="Groq requests started per minute")
+    parser.add_argument("--burst", type=int, default=5, help="requests allowed back to back before the rate limit applies")
+    parser.add_argument("--retries", type=int, default=2, help="retries of a failed plan before it is written as an error")
+    parser.add_argument("--retry-delay", type=float, default=5, help="seconds before the first retry, doubled each time")
+    parser.add_argument("--no-maps", dest="maps", action="store_false", help="skip geocoding and map HTML")
+    parser.add_argument("--regenerate", action="store_true", help="do not reuse plans from the plan cache")
+    args = parser.parse_args()
+
+    rows = read_rows(args.input)
+    done = finished_ids(args.output)
+    seen = set()
+    pending = []
+    for row_id, params in rows:
+        if row_id in done or row_id in seen:
+            continue
+        if not (params["destination"] or params["details"]):
+            print(f"Skipping {row_id}: needs a destination or trip details", flush=True)
+            continue
+        seen.add(row_id)
+        pending.append((row_id, params))
+    print(f"{len(rows)} rows, {len(pending)} to generate", flush=True)
+    if not pending:
+        return
+
+    ok, failed = asyncio.run(run(args, pending))
+    print(f"Done: {ok} ok, {failed} failed")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+#Offline load benchmark for Tripper
+#
+#Starts local stand-ins for the Groq API, Nominatim, the Google speech API and gTTS, points
+#app.py at them through its environment settings and drives the chat, planner, map,
+#text-to-speech and speech handlers with N concurrent simulated sessions.
+#
+#   python benchmark.py --sessions 20 --token-rate 200 --latency 0.3
+#   python benchmark.py --compare bench_results/20250301-120000.json
+#
+#Each run is saved as JSON under bench_results/ so releases can be compared. Cold start
+#(importing app.py and building the UI in a fresh process) is measured against --import-budget.
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SCENARIOS = ["chat", "burst", "plan", "translate", "map", "tts", "speech"]
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CENTER = (48.8566, 2.3522)
+
+#Local stand-in for every external service the app talks to
+class FakeServices(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.3          # Seconds before the first LLM token
+    token_rate = 200.0     # LLM tokens per second
+    tokens = 400           # Tokens per LLM answer
+    places = 12            # Places in each generated plan
+    geocode_latency = 0.05
+    speech_latency = 0.2
+    tts_latency = 0.1
+    tts_chars_per_second = 2000.0
+    llm_calls = 0          # Upstream LLM requests served so far
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/search":
+            self.nominatim(parse_qs(url.query).get("q", [""])[0])
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/openai/v1/chat/completions"):
+            self.chat_completion(json.loads(body))
+        elif "speech-api" in self.path:
+            # Reached through http_proxy, so the path is the full Google URL
+            time.sleep(self.speech_latency)
+            result = {"result": [{"alternative": [{"transcript": "plan a trip to paris", "confidence": 0.9}], "final": True}], "result_index": 0}
+            self.send_text('{"result":[]}\n' + json.dumps(result) + "\n")
+        elif "batchexecute" in self.path:
+            self.tts(parse_qs(body.decode("utf-8"))["f.req"][0])
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def nominatim(self, query):
+        time.sleep(self.geocode_latency)
+        if "nowhere" in query.lower():
+            self.send_json([])
+            return
+        digest = hashlib.sha256(query.encode("utf-8")).digest()
+        lat = CENTER[0] + (digest[0] - 128) / 1000
+        lon = CENTER[1] + (digest[1] - 128) / 1000
+        self.send_json([{"lat": str(lat), "lon": str(lon), "display_name": query, "place_id": digest[2]}])
+
+    #Answers like Google Translate's batchexecute: tts_latency plus time per character, then
+    #dummy mp3 bytes in the same envelope, so gTTS requests and parsing run for real
+    def tts(self, rpc):
+        text = json.loads(json.loads(rpc)[0][0][1])[0]
+        time.sleep(self.tts_latency + len(text) / self.tts_chars_per_second)
+        audio = json.dumps([base64.b64encode(b"\xff\xfb\x90\x00" * max(1, len(text))).decode("ascii")])
+        payload = json.dumps([["wrb.fr", "jQ1olc", audio, None, None, None, "generic"]], separators=(",", ":"))
+        self.send_text(f")]}}'\n\n{len(payload)}\n{payload}\n", content_type="application/json")
+
+    def answer_for(self, messages):
+        system = messages[0]["content"] if messages else ""
+        # Sentences of twelve words, so sentence-level text-to-speech has something to split
+        words = [f"word{i % 50}" + ("." if i % 12 == 11 else "") for i in range(self.tokens)]
+        if system.startswith("You are a holiday planner"):
+            # Places are mentioned in bold as the plan goes, like in real itineraries
+            for k in range(min(self.places, len(words) // 12)):
+                words[k * 12] = f"**Place {k}**"
+        text = " ".join(words) + "."
+        names = ["Benchmark City"] + [f"Place {i}" for i in range(self.places)]
+        if system.startswith("Translate the travel plan"):
+            text = messages[-1]["content"]
+        elif "<<<PLACES>>>" in system:
+            entries = [{"name": names[0], "type": "destination"}] + [{"name": name, "type": "attraction"} for name in names[1:]]
+            text += "\n<<<PLACES>>>\n" + json.dumps(entries)
+        elif system.startswith("Extract the names of places"):
+            text = "\n".join(names)
+        return text
+
+    def chat_completion(self, request):
+        FakeServices.llm_calls += 1
+        text = self.answer_for(request.get("messages", []))
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": request.get("model", "bench")}
+        time.sleep(self.latency)
+        if not request.get("stream"):
+            time.sleep(len(text.split(" ")) / self.token_rate)
+            self.send_json(dict(base, object="chat.completion", choices=[
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+            ], usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tokens = text.split(" ")
+        for i, token in enumerate(tokens):
+            content = token if i == len(tokens) - 1 else token + " "
+            chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {"content": content}, "finish_reason": None}])
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            time.sleep(1 / self.token_rate)
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, data, status=200):
+        self.send_text(json.dumps(data), status, "application/json")
+
+    def send_text(self, text, status=200, content_type="text/plain"):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_fake_services(args):
+    FakeServices.latency = args.latency
+    FakeServices.token_rate = args.token_rate
+    FakeServices.tokens = args.tokens
+    FakeServices.places = args.places
+    FakeServices.geocode_latency = args.geocode_latency
+    FakeServices.speech_latency = args.speech_latency
+    FakeServices.tts_latency = args.tts_latency
+    FakeServices.tts_chars_per_second = args.tts_chars_per_second
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeServices)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+#Points the app at the fake services; must run before app is imported
+def configure_environment(address, args, cache_dir):
+    os.environ.update({
+        "GROQ_API_KEY": "benchmark",
+        "GROQ_BASE_URL": f"http://{address}",
+        "NOMINATIM_DOMAIN": address,
+        "NOMINATIM_SCHEME": "http",
+        "GEOCODE_RATE": str(args.geocode_rate),
+        "GEOCODE_BURST": str(args.geocode_rate),
+        "TRIPPER_CACHE_DIR": cache_dir,
+        "SPEECH_BACKEND": "google",
+        # recognize_google has a fixed http:// URL, so it is sent to the fake server as a proxy
+        "http_proxy": f"http://{address}",
+        "no_proxy": "127.0.0.1,localhost",
+    })
+
+#gTTS always calls https://translate.google.<tld>, so the app's pooled gTTS session gets an
+#adapter that sends those requests to the fake server instead
+def route_gtts_to(address):
+    import http_clients
+    from requests.adapters import HTTPAdapter
+
+    class FakeGoogleAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            url = urlparse(request.url)
+            request.url = url._replace(scheme="http", netloc=address).geturl()
+            return super().send(request, **kwargs)
+
+    adapter = FakeGoogleAdapter(pool_connections=http_clients.HTTP_POOL_HOSTS, pool_maxsize=http_clients.HTTP_POOL_SIZE)
+    http_clients.get_session("gtts").mount("https://translate.google.", adapter)
+
+def write_silence(path, seconds):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\x00\x00" * int(16000 * seconds))
+
+def percentiles(values):
+    if not values:
+        return None
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "mean": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "mean": statistics.fmean(values)}
+
+#Session drivers: each returns (time to first token/audio, end-to-end time) in seconds
+#burst sends the same prompt from every session, like many users clicking one example
+async def chat_session(app, i, audio=False, prompt=None):
+    start = time.perf_counter()
+    first = None
+    message = {"text": prompt or f"What should I see in benchmark city {i}?", "files": []}
+    async for history, segment in app.chat_with_bot_stream(message, audio, "🇬🇧 English", app.new_session_id()):
+        if first is None and (segment if audio else history and history[-1]["role"] == "assistant" and history[-1]["content"]):
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+#End-to-end for a plan includes its map
+async def plan_session(app, i):
+    start = time.perf_counter()
+    first = None
+    async for plan_text, places, error, _, _ in app.generate_plan(f"Trip number {i}", f"Benchmark City {i}", "museums", 3, 1000, "", 2, "USD", "🇬🇧 English", True, app.new_session_id()):
+        if first is None and plan_text:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+#The same trip in French after it was planned in English: only the French request is timed
+async def translate_session(app, i):
+    params = (f"Translation trip {i}", f"Benchmark City {i}", "museums", 3, 1000, "", 2, "USD")
+    async for _ in app.generate_plan(*params, "🇬🇧 English", False, app.new_session_id(), False):
+        pass
+    start = time.perf_counter()
+    first = None
+    async for plan_text, places, error, _, _ in app.generate_plan(*params, "🇫🇷 Français", False, app.new_session_id()):
+        if first is None and plan_text:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+async def map_session(app, i):
+    places = "\n".join([f"Benchmark City {i}"] + [f"Place {i}-{j}" for j in range(FakeServices.places)] + ["Nowhere"])
+    start = time.perf_counter()
+    await asyncio.to_thread(app.generate_map, places)
+    return None, time.perf_counter() - start
+
+async def speech_session(speech, paths):
+    start = time.perf_counter()
+    await asyncio.to_thread(speech.transcribe_files, paths)
+    return None, time.perf_counter() - start
+
+async def run_scenario(name, make_session, sessions, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    llm_calls = FakeServices.llm_calls
+    results = await asyncio.gather(*(make_session(i) for i in range(sessions)), return_exceptions=True)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    errors = [repr(r) for r in results if isinstance(r, BaseException)]
+    report = {
+        "sessions": sessions,
+        "errors": len(errors),
+        "ttft": percentiles([r[0] for r in ok if r[0] is not None]),
+        "latency": percentiles([r[1] for r in ok]),
+        "throughput": len(ok) / wall if wall else 0,
+        "wall_seconds": wall,
+        "llm_calls": FakeServices.llm_calls - llm_calls,
+        "peak_python_mb": peak / 1024 / 1024 if peak is not None else None,
+        # ru_maxrss is the high-water mark of the whole benchmark process so far, not of this
+        # scenario alone: it only shows a scenario that pushed it above every earlier one
+        "process_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if errors:
+        report["first_error"] = errors[0]
+    return report
+
+async def run(args, address, cache_dir):
+    import app
+    import speech
+
+    route_gtts_to(address)
+    wav_paths = []
+    for n in range(args.speech_files):
+        path = os.path.join(cache_dir, f"voice_{n}.wav")
+        write_silence(path, 2)
+        wav_paths.append(path)
+
+    drivers = {
+        "chat": lambda i: chat_session(app, i),
+        "burst": lambda i: chat_session(app, i, prompt="Plan a four day trip to Benchmark City for a nature-loving family."),
+        "plan": lambda i: plan_session(app, i),
+        "translate": lambda i: translate_session(app, i),
+        "map": lambda i: map_session(app, i),
+        "tts": lambda i: chat_session(app, i, audio=True),
+        "speech": lambda i: speech_session(speech, wav_paths),
+    }
+    results = {}
+    for name in args.scenarios:
+        print(f"Running {name} with {args.sessions} sessions...", flush=True)
+        results[name] = await run_scenario(name, drivers[name], args.sessions, args.trace_memory)
+        print(format_report(name, results[name]), flush=True)
+    return results
+
+#Imports app in fresh processes; latency is the time to a built UI
+def cold_start(runs, budget):
+    code = "import time; t = time.perf_counter(); import app; app.build_demo(); print(time.perf_counter() - t)"
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    stats = percentiles(times)
+    return {"runs": runs, "latency": stats, "budget_seconds": budget, "over_budget": stats["p50"] > budget}
+
+def format_report(name, report):
+    def ms(stats, key):
+        return f"{stats[key] * 1000:.0f}ms" if stats else "-"
+    return (
+        f"  {name:7} ttft p50 {ms(report['ttft'], 'p50')} p95 {ms(report['ttft'], 'p95')} | "
+        f"latency p50 {ms(report['latency'], 'p50')} p95 {ms(report['latency'], 'p95')} p99 {ms(report['latency'], 'p99')} | "
+        f"{report['throughput']:.2f} sessions/s | llm calls {report['llm_calls']} | errors {report['errors']} | process rss high-water {report['process_peak_rss_mb']:.0f}MB"
+    )
+
+#Returns a list of regressions of the current results against a saved run
+def compare(current, baseline, threshold):
+    regressions = []
+    for name, report in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        for metric in ("ttft", "latency"):
+            for key in ("p50", "p95"):
+                if report.get(metric) and old.get(metric) and report[metric][key] > old[metric][key] * (1 + threshold):
+                    regressions.append(f"{name} {metric} {key}: {old[metric][key] * 1000:.0f}ms -> {report[metric][key] * 1000:.0f}ms")
+        if "throughput" in report and report["throughput"] < old["throughput"] * (1 - threshold):
+            regressions.append(f"{name} throughput: {old['throughput']:.2f} -> {report['throughput']:.2f} sessions/s")
+        if report.get("errors", 0) > old.get("errors", 0):
+            regressions.append(f"{name} errors: {old['errors']} -> {report['errors']}")
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for Tripper")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM time to first token (s)")
+    parser.add_argument("--token-rate", type=float, default=200, help="fake LLM tokens per second")
+    parser.add_argument("--tokens", type=int, default=400, help="tokens per fake LLM answer")
+    parser.add_argument("--places", type=int, default=12, help="places per fake plan")
+    parser.add_argument("--geocode-latency", type=float, default=0.05)
+    parser.add_argument("--geocode-rate", type=float, default=50, help="geocoding requests per second allowed")
+    parser.add_argument("--speech-latency", type=float, default=0.2)
+    parser.add_argument("--speech-files", type=int, default=2, help="recordings per speech session")
+    parser.add_argument("--tts-latency", type=float, default=0.1)
+    parser.add_argument("--tts-chars-per-second", type=float, default=2000)
+    parser.add_argument("--cold-start-runs", type=int, default=3, help="fresh-process imports of app.py to time (0 to skip)")
+    parser.add_argument("--import-budget", type=float, default=8.0, help="allowed p50 cold start in seconds")
+    parser.add_argument("--trace-memory", action="store_true", help="also report peak Python heap per scenario (slower)")
+    parser.add_argument("--output-dir", default="bench_results")
+    parser.add_argument("--compare", help="saved run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    server = start_fake_services(args)
+    address = f"127.0.0.1:{server.server_address[1]}"
+    with tempfile.TemporaryDirectory() as cache_dir:
+        configure_environment(address, args, cache_dir)
+        sys.path.insert(0, APP_DIR)
+        results = {}
+        if args.cold_start_runs:
+            print(f"Timing cold start over {args.cold_start_runs} runs...", flush=True)
+            results["coldstart"] = cold_start(args.cold_start_runs, args.import_budget)
+            stats = results["coldstart"]["latency"]
+            print(f"  coldstart p50 {stats['p50']:.2f}s p95 {stats['p95']:.2f}s (budget {args.import_budget:.2f}s)", flush=True)
+        results.update(asyncio.run(run(args, address, cache_dir)))
+    server.shutdown()
+
+    run_data = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output_dir", "compare")},
+        "results": results,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run_data, f, indent=2)
+    print(f"Saved {path}")
+
+    regressions = []
+    if results.get("coldstart", {}).get("over_budget"):
+        regressions.append(f"coldstart p50 {results['coldstart']['latency']['p50']:.2f}s is over the {args.import_budget:.2f}s budget")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions += compare(run_data, json.load(f), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    if args.compare:
+        print("No regressions")
+
+if __name__ == "__main__":
+    main()
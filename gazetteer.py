@@ -0,0 +1,305 @@
+#Offline geocoding from a GeoNames dump
+#
+#Build the index once from a dump such as cities15000.txt or allCountries.txt
+#(https://download.geonames.org/export/dump/):
+#
+#   python gazetteer.py build allCountries.txt --output .cache/gazetteer
+#
+#The index is a handful of numpy arrays that are memory mapped when loaded, so it costs
+#almost no RAM or start-up time. Exact lookups are a binary search over hashed names;
+#places near a point are found through a grid of one degree cells, which also limits the
+#fuzzy matching of names that have no exact match. Each cell's names get a trigram index the
+#first time a lookup needs it, so a fuzzy match only compares the few names that share most
+#of their trigrams with the query.
+import argparse
+import array
+from collections import OrderedDict
+import difflib
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+CELLS_PER_ROW = 360
+FUZZY_RADIUS_KM = float(os.getenv("GAZETTEER_FUZZY_RADIUS_KM", 50))
+FUZZY_CUTOFF = float(os.getenv("GAZETTEER_FUZZY_CUTOFF", 0.88))
+FUZZY_CANDIDATES = int(os.getenv("GAZETTEER_FUZZY_CANDIDATES", 50))   # Names per cell compared with difflib
+CELL_CACHE_SIZE = int(os.getenv("GAZETTEER_CELL_CACHE", 64))         # Cell trigram indexes kept in memory
+
+# Lower case, no accents, no punctuation or markdown, single spaces: "  **Musée du Louvre** " == "musee du louvre"
+def normalize_name(name):
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"^[\s\-\*\d\.\)#]+", "", name.lower())
+    name = re.sub(r"[^\w\s]", " ", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+def name_hash(normalized):
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+# Normalized forms a name is looked up under
+def name_variants(name):
+    # "Eiffel Tower, Paris": the part before the comma is the place itself
+    variants = [normalize_name(name)]
+    if "," in name:
+        variants.append(normalize_name(name.split(",")[0]))
+    variants += [variant[4:] for variant in variants if variant.startswith("the ")]
+    return [variant for variant in dict.fromkeys(variants) if variant]
+
+# " eiffel tower " -> {" ei", "eif", ...}; the padding makes the first and last letters count
+def trigrams(normalized):
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def cell_of(lat, lon):
+    row = np.clip(np.floor(np.asarray(lat) + 90), 0, 179).astype(np.int32)
+    col = np.floor(np.asarray(lon) + 180).astype(np.int32) % CELLS_PER_ROW
+    return row * CELLS_PER_ROW + col
+
+def distance_km(origin, points):
+    lat1, lon1 = np.radians(origin[0]), np.radians(origin[1])
+    lat2, lon2 = np.radians(points[:, 0]), np.radians(points[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class Gazetteer:
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+        self.coords = load("coords.npy")            # (N, 2) float32 lat, lon
+        self.population = load("population.npy")    # (N,) uint32
+        self.hashes = load("name_hashes.npy")       # Sorted uint64 hashes of every name variant
+        self.hash_ids = load("name_ids.npy")        # Entry of each hash
+        self.cells = load("cells.npy")              # Sorted grid cell of every entry
+        self.cell_ids = load("cell_ids.npy")        # Entry of each cell
+        self.name_offsets = load("name_offsets.npy")
+        self.names = np.memmap(os.path.join(directory, "names.bin"), dtype=np.uint8, mode="r")
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "fuzzy_hits": 0, "misses": 0}
+        self.cell_indexes = OrderedDict()           # cell -> (names, entries of each name, trigram -> name positions)
+
+    def __len__(self):
+        return len(self.coords)
+
+    # Normalized names of an entry, its main name first
+    def names_of(self, entry):
+        return bytes(self.names[self.name_offsets[entry]:self.name_offsets[entry + 1]]).decode("utf-8").split("\n")
+
+    def exact(self, normalized):
+        h = np.uint64(name_hash(normalized))
+        lo = np.searchsorted(self.hashes, h, "left")
+        hi = np.searchsorted(self.hashes, h, "right")
+        return np.asarray(self.hash_ids[lo:hi])
+
+    # Whether any place anywhere has exactly this name
+    def knows(self, name):
+        return any(len(self.exact(variant)) for variant in name_variants(name))
+
+    # Grid cells that cover radius_km around (lat, lon)
+    def cells_near(self, lat, lon, radius_km):
+        lat_span = radius_km / 111.0
+        lon_span = min(180.0, radius_km / (111.0 * max(np.cos(np.radians(lat)), 0.01)))
+        rows = range(int(np.floor(max(lat - lat_span, -90) + 90)), int(np.floor(min(lat + lat_span, 89.999) + 90)) + 1)
+        cols = {int(c) % CELLS_PER_ROW for c in range(int(np.floor(lon - lon_span + 180)), int(np.floor(lon + lon_span + 180)) + 1)}
+        return [row * CELLS_PER_ROW + col for row in rows for col in sorted(cols)]
+
+    def cell_entries(self, cell):
+        lo = np.searchsorted(self.cells, cell, "left")
+        hi = np.searchsorted(self.cells, cell, "right")
+        return self.cell_ids[lo:hi]
+
+    # Entries in the grid cells that cover radius_km around (lat, lon); may include some further away
+    def nearby(self, lat, lon, radius_km):
+        chunks = [ids for ids in (self.cell_entries(cell) for cell in self.cells_near(lat, lon, radius_km)) if len(ids)]
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int32)
+
+    # Names of a cell with their entries and a trigram index, built once and kept in an LRU
+    def cell_index(self, cell):
+        with self.lock:
+            index = self.cell_indexes.get(cell)
+            if index is not None:
+                self.cell_indexes.move_to_end(cell)
+                return index
+        names = {}
+        for entry in self.cell_entries(cell):
+            for entry_name in self.names_of(entry):
+                names.setdefault(entry_name, []).append(int(entry))
+        postings = {}
+        for position, entry_name in enumerate(names):
+            for gram in trigrams(entry_name):
+                postings.setdefault(gram, []).append(position)
+        index = (
+            list(names),
+            [np.array(ids, dtype=np.int32) for ids in names.values()],
+            {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()},
+        )
+        with self.lock:
+            self.cell_indexes[cell] = index
+            while len(self.cell_indexes) > CELL_CACHE_SIZE:
+                self.cell_indexes.popitem(last=False)
+        return index
+
+    # Closest name to variant within radius_km of near, as difflib.get_close_matches would pick it,
+    # but only the FUZZY_CANDIDATES names of each cell sharing the most trigrams are compared
+    def fuzzy(self, variant, near, radius_km):
+        grams = trigrams(variant)
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(variant)
+        matches = {}   # name -> (ratio, entries in each cell)
+        for cell in self.cells_near(near[0], near[1], radius_km):
+            names, entries, postings = self.cell_index(cell)
+            hits = [postings[gram] for gram in grams if gram in postings]
+            if not hits:
+                continue
+            shared = np.bincount(np.concatenate(hits), minlength=len(names))
+            top = np.argsort(-shared, kind="stable")[:FUZZY_CANDIDATES] if len(names) > FUZZY_CANDIDATES else np.arange(len(names))
+            for position in top:
+                if shared[position] == 0:
+                    continue
+                matcher.set_seq1(names[position])
+                if matcher.real_quick_ratio() >= FUZZY_CUTOFF and matcher.quick_ratio() >= FUZZY_CUTOFF:
+                    ratio = matcher.ratio()
+                    if ratio >= FUZZY_CUTOFF:
+                        matches.setdefault(names[position], (ratio, []))[1].append(entries[position])
+        for name in sorted(matches, key=lambda name: (matches[name][0], name), reverse=True):
+            entry = self.best(np.concatenate(matches[name][1]), near, radius_km)
+            if entry is not None:
+                return entry
+        return None
+
+    # Most likely entry: the most populated one, then the closest to near
+    def best(self, ids, near=None, radius_km=None):
+        if len(ids) == 0:
+            return None
+        coords = np.asarray(self.coords[ids], dtype=np.float64)
+        if near is None:
+            return ids[int(np.argmax(self.population[ids]))]
+        distances = distance_km(near, coords)
+        if radius_km is not None:
+            inside = distances <= radius_km
+            if not inside.any():
+                return None
+            ids, distances = ids[inside], distances[inside]
+        order = np.lexsort((distances, -np.asarray(self.population[ids], dtype=np.int64)))
+        return ids[order[0]]
+
+    # [lat, lon] of a place name, or None. With near, only places within radius_km of it count,
+    # and names without an exact match are matched fuzzily against places close to it.
+    def lookup(self, name, near=None, radius_km=500):
+        variants = name_variants(name)
+        if not variants:
+            return None
+
+        for variant in variants:
+            entry = self.best(self.exact(variant), near, radius_km if near is not None else None)
+            if entry is not None:
+                self.count("hits")
+                return self.coords_of(entry)
+
+        if near is not None:
+            for variant in variants:
+                entry = self.fuzzy(variant, near, FUZZY_RADIUS_KM)
+                if entry is not None:
+                    self.count("fuzzy_hits")
+                    return self.coords_of(entry)
+        self.count("misses")
+        return None
+
+    def coords_of(self, entry):
+        lat, lon = self.coords[entry]
+        return [float(lat), float(lon)]
+
+    def count(self, event):
+        with self.lock:
+            self.stats[event] += 1
+
+def load_gazetteer(directory):
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+    return Gazetteer(directory)
+
+# GeoNames columns used: 1 name, 2 asciiname, 3 alternatenames, 4 latitude, 5 longitude,
+# 6 feature class, 14 population
+def build(source, directory, feature_classes=None, alternate_names=True):
+    os.makedirs(directory, exist_ok=True)
+    coords = array.array("f")
+    population = array.array("I")
+    hashes = array.array("Q")
+    hash_ids = array.array("i")
+    name_offsets = array.array("q", [0])
+    names = bytearray()
+
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 15 or (feature_classes and columns[6] not in feature_classes):
+                continue
+            try:
+                lat, lon = float(columns[4]), float(columns[5])
+            except ValueError:
+                continue
+            entry = len(population)
+            coords.extend((lat, lon))
+            population.append(min(int(columns[14] or 0), 2**32 - 1))
+            variants = [normalize_name(columns[1]), normalize_name(columns[2])]
+            if alternate_names and columns[3]:
+                variants += [normalize_name(alt) for alt in columns[3].split(",")]
+            variants = [variant for variant in dict.fromkeys(variants) if variant]
+            names += "\n".join(variants).encode("utf-8")
+            name_offsets.append(len(names))
+            for variant in variants:
+                hashes.append(name_hash(variant))
+                hash_ids.append(entry)
+
+    hashes = np.frombuffer(hashes, dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    coords = np.frombuffer(coords, dtype=np.float32).reshape(-1, 2)
+    cells = cell_of(coords[:, 0], coords[:, 1])
+    cell_order = np.argsort(cells, kind="stable")
+
+    np.save(os.path.join(directory, "coords.npy"), coords)
+    np.save(os.path.join(directory, "population.npy"), np.frombuffer(population, dtype=np.uint32))
+    np.save(os.path.join(directory, "name_hashes.npy"), hashes[order])
+    np.save(os.path.join(directory, "name_ids.npy"), np.frombuffer(hash_ids, dtype=np.int32)[order])
+    np.save(os.path.join(directory, "cells.npy"), cells[cell_order])
+    np.save(os.path.join(directory, "cell_ids.npy"), cell_order.astype(np.int32))
+    np.save(os.path.join(directory, "name_offsets.npy"), np.frombuffer(name_offsets, dtype=np.int64))
+    with open(os.path.join(directory, "names.bin"), "wb") as f:
+        f.write(names)
+    # Written last: an index without meta.json is incomplete and is not loaded
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.basename(source), "entries": len(coords), "names": len(hashes), "built_at": time.strftime("%Y-%m-%dT%H:%M:%S")}, f)
+    return len(coords)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline gazetteer for Tripper")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build the index from a GeoNames dump")
+    build_parser.add_argument("source", help="GeoNames dump, e.g. allCountries.txt")
+    build_parser.add_argument("--output", default=os.path.join(os.getenv("TRIPPER_CACHE_DIR", ".cache"), "gazetteer"))
+    build_parser.add_argument("--feature-classes", default="", help="GeoNames feature classes to keep, e.g. APST (default: all)")
+    build_parser.add_argument("--no-alternate-names", dest="alternate_names", action="store_false")
+    lookup_parser = commands.add_parser("lookup", help="look a name up in a built index")
+    lookup_parser.add_argument("name")
+    lookup_parser.add_argument("--near", nargs=2, type=float, metavar=("LAT", "LON"))
+    lookup_parser.add_argument("--index", default=os.path.join(os.getenv("TRIPPER_CACHE_DIR", ".cache"), "gazetteer"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        count = build(args.source, args.output, set(args.feature_classes) or None, args.alternate_names)
+        print(f"Indexed {count} places into {args.output} in {time.perf_counter() - start:.1f}s")
+    else:
+        gazetteer = load_gazetteer(args.index)
+        if gazetteer is None:
+            raise SystemExit(f"No gazetteer index in {args.index}")
+        print(gazetteer.lookup(args.name, args.near))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import importlib.util
+import os
+import threading
+
+from metrics import metrics
+
+# Shared outbound HTTP clients. Geocoding, speech recognition, text to speech and Groq each
+# used to open fresh connections per call; they now reuse keep-alive connections from a
+# pool per host, so a busy instance only pays the TCP/TLS handshake once per connection.
+# requests and httpx are imported on first use, like the clients that need them.
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", 10))        # Hosts with a pool of their own
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))          # Keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+# Groq streams are long lived, so its pool is sized for the chat concurrency
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 200))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", 50))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+# "auto" uses HTTP/2 for Groq when the h2 package is installed
+HTTP2 = os.getenv("HTTP2", "auto")
+
+REQUEST_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)   # requests' (connect, read)
+
+metrics.describe("tripper_http_requests", "Outbound HTTP requests by client and host", kind="counter")
+metrics.describe("tripper_http_connections_opened", "Connections opened by client and host; the rest of the requests reused one", kind="counter")
+metrics.describe("tripper_http_idle_connections", "Idle keep-alive connections by client and host")
+
+_lock = threading.Lock()
+_sessions = {}       # name -> requests.Session
+_async_clients = {}  # name -> (httpx.AsyncClient, stats per host, stats lock)
+
+def pooled_adapter(max_retries=0):
+    from requests.adapters import HTTPAdapter
+    return HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=max_retries)
+
+# Adds a session made elsewhere (e.g. by geopy) to the pool metrics
+def register_session(name, session):
+    with _lock:
+        _sessions[name] = session
+
+# requests.Session shared by the callers that pass the same name; thread safe for sending
+def get_session(name):
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.mount("http://", pooled_adapter())
+            session.mount("https://", pooled_adapter())
+            _sessions[name] = session
+        return session
+
+# adapter_factory for geopy geocoders: geopy keeps its own session (it applies its own proxy
+# and SSL settings), built with the shared pool sizes and registered for the pool metrics.
+# Retries stay with the caller, which rate limits them.
+def geopy_adapter_factory(name):
+    def factory(proxies=None, ssl_context=None):
+        from geopy.adapters import RequestsAdapter
+        adapter = RequestsAdapter(
+            proxies=proxies, ssl_context=ssl_context,
+            pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=0
+        )
+        register_session(name, adapter.session)
+        return adapter
+    return factory
+
+def http2_enabled():
+    if HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return HTTP2 == "1"
+
+# httpx.AsyncClient for an async SDK such as AsyncGroq. A trace hook counts requests and
+# new connections per host, which httpx does not keep itself.
+def get_async_client(name):
+    with _lock:
+        if name in _async_clients:
+            return _async_clients[name][0]
+        import httpx
+        stats = {}
+        stats_lock = threading.Lock()
+
+        def count(host, event):
+            with stats_lock:
+                host_stats = stats.setdefault(host, {"requests": 0, "connections": 0})
+                host_stats[event] += 1
+
+        async def on_request(request):
+            host = request.url.host
+            count(host, "requests")
+
+            async def trace(event_name, info):
+                if event_name == "connection.connect_tcp.complete":
+                    count(host, "connections")
+            request.extensions["trace"] = trace
+
+        client = httpx.AsyncClient(
+            http2=http2_enabled(),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [on_request]},
+        )
+        _async_clients[name] = (client, stats, stats_lock)
+        return client
+
+# Pool usage at scrape time: requests sent and connections opened per host (their ratio is
+# the connection reuse), and idle keep-alive connections
+def collect():
+    samples = []
+    with _lock:
+        sessions = list(_sessions.items())
+        async_clients = list(_async_clients.items())
+    for name, session in sessions:
+        managers = []
+        for adapter in set(session.adapters.values()):
+            # Requests sent through a proxy are pooled in the proxy's own manager
+            managers += [getattr(adapter, "poolmanager", None)] + list(getattr(adapter, "proxy_manager", {}).values())
+        for manager in filter(None, managers):
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                labels = {"client": name, "host": pool.host}
+                samples.append(("tripper_http_requests", labels, pool.num_requests))
+                samples.append(("tripper_http_connections_opened", labels, pool.num_connections))
+                # The pool queue is padded with None up to its size
+                samples.append(("tripper_http_idle_connections", labels, sum(1 for conn in list(pool.pool.queue) if conn is not None)))
+    for name, (client, stats, stats_lock) in async_clients:
+        with stats_lock:
+            hosts = {host: dict(host_stats) for host, host_stats in stats.items()}
+        for host, host_stats in hosts.items():
+            labels = {"client": name, "host": host}
+            samples.append(("tripper_http_requests", labels, host_stats["requests"]))
+            samples.append(("tripper_http_connections_opened", labels, host_stats["connections"]))
+        connections = getattr(getattr(getattr(client, "_transport", None), "_pool", None), "connections", [])
+        samples.append(("tripper_http_idle_connections", {"client": name, "host": "*"}, sum(1 for conn in connections if conn.is_idle())))
+    return samples
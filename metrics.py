@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Structured logs: one JSON object per line, tagged with the id of the request being served
+logger = logging.getLogger("tripper")
+request_id = contextvars.ContextVar("request_id", default="-")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600)
+
+# Minimal thread-safe counters and histograms, rendered in the Prometheus text format.
+# Updates are a dict lookup and an add under a lock, cheap enough to leave on.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.help = {}
+        self.kinds = {}
+
+    # kind only matters for collector samples, which are gauges unless described otherwise
+    def describe(self, name, text, kind=None):
+        self.help[name] = text
+        if kind:
+            self.kinds[name] = kind
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = (buckets, [0] * len(buckets) + [0, 0.0])
+            bounds, counts = histogram
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    # fn returns [(name, labels dict, value), ...] at scrape time, for state kept elsewhere
+    def register_collector(self, fn):
+        self.collectors.append(fn)
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {escape_help(self.help[name])}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        def label_text(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in items) + "}"
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (bounds, list(counts))) for key, (bounds, counts) in self.histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for (name, labels), (bounds, counts) in histograms:
+            header(name, "histogram")
+            for bound, count in zip(bounds, counts):
+                lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {counts[-2]}")
+            lines.append(f"{name}_count{label_text(labels)} {counts[-2]}")
+            lines.append(f"{name}_sum{label_text(labels)} {counts[-1]}")
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                header(name, self.kinds.get(name, "gauge"))
+                lines.append(f"{name}{label_text(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+# Text exposition format: label values escape backslash, double quote and newline; HELP
+# text only backslash and newline
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+metrics = Metrics()
+metrics.describe("tripper_stage_seconds", "Time spent in each stage of a request")
+metrics.describe("tripper_errors_total", "Errors by stage")
+metrics.describe("tripper_ttft_seconds", "Time to first token of streamed completions")
+metrics.describe("tripper_tokens_total", "LLM tokens in and out")
+metrics.describe("tripper_tokens_per_second", "Output tokens per second of streamed completions")
+
+def new_request_id():
+    rid = uuid.uuid4().hex[:12]
+    request_id.set(rid)
+    return rid
+
+# Nested stages (e.g. a map rendered inside a plan request) keep the id of their request
+def ensure_request_id():
+    return request_id.get() if request_id.get() != "-" else new_request_id()
+
+def log_event(event, **fields):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, "request_id": request_id.get(), **fields}, ensure_ascii=False, default=str))
+
+# Counts and logs an error that was handled rather than raised
+def record_error(stage, error, **fields):
+    metrics.inc("tripper_errors_total", stage=stage, error=type(error).__name__)
+    log_event("error", stage=stage, error=repr(error), **fields)
+
+# Times a stage: records its duration, counts errors and writes one log line
+@contextmanager
+def span(stage, **fields):
+    start = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except (GeneratorExit, asyncio.CancelledError):
+        error = "cancelled"
+        raise
+    except BaseException as e:
+        error = type(e).__name__
+        metrics.inc("tripper_errors_total", stage=stage, error=error)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe("tripper_stage_seconds", duration, stage=stage)
+        log_event("span", stage=stage, duration_ms=round(duration * 1000, 1), error=error, **fields)
+
+def record_tokens(task, tokens_in=0, tokens_out=0):
+    if tokens_in:
+        metrics.inc("tripper_tokens_total", tokens_in, task=task, direction="in")
+    if tokens_out:
+        metrics.inc("tripper_tokens_total", tokens_out, task=task, direction="out")
@@ -0,0 +1,182 @@
+import re
+import threading
+import unicodedata
+from collections import deque
+
+# Local place extraction for generated itineraries. Two sources of candidates:
+# - the markdown the planner writes: bold names and headings ("**Louvre Museum**", "### Musée d'Orsay")
+# - a dictionary of known place names (places geocoded before for the same destination),
+#   matched in one pass over the words of the text with an Aho-Corasick automaton
+# Both run in a few milliseconds for a full plan, no model involved. confidence() tells how
+# many of the places found are known ones, so callers can decide whether to trust them.
+
+WORD = re.compile(r"\w+(?:['’]\w+)*")
+BOLD = re.compile(r"\*\*(.+?)\*\*|__(.+?)__")
+HEADING = re.compile(r"^\s*#{1,6}\s*(.+?)\s*#*\s*$", re.MULTILINE)
+# "3-Day Trip to Paris", "Itinerary for Kyoto", "Your Week in Lisbon"
+DESTINATION = re.compile(
+    r"\b(?i:trip|itinerary|vacation|holiday|getaway|adventure|escape|guide|week|weekend|days?)\s+(?i:to|in|for|around|through)\s+"
+    r"((?:[A-ZÀ-ɏ][\w'’\-]*)(?:\s+(?:[A-ZÀ-ɏ][\w'’\-]*|de|del|la|le|of|the|da|do)){0,3})"
+)
+# Bold labels in itineraries that are not places
+LABELS = {
+    "morning", "afternoon", "evening", "night", "late night", "breakfast", "lunch", "dinner", "brunch", "snack",
+    "budget", "total", "total cost", "estimated cost", "estimated budget", "daily budget", "budget breakdown", "cost", "costs",
+    "price", "prices", "tip", "tips", "note", "notes", "important", "optional", "overview", "summary", "itinerary",
+    "accommodation", "accommodations", "where to stay", "where to eat", "hotel", "hotels", "restaurant", "restaurants",
+    "attractions", "activities", "activity", "food", "local food", "transportation", "transport", "getting around",
+    "getting there", "arrival", "departure", "check in", "check out", "free time", "rest", "weather", "packing",
+    "highlights", "recommendations", "option", "options", "alternative", "alternatives", "day trip", "travel tips",
+    "best time to visit", "duration", "travelers", "travellers", "language", "currency", "visa", "safety",
+}
+# Words of titles and section names ("Paris 3-Day Itinerary", "Trip Overview")
+TITLE_WORDS = {"itinerary", "trip", "vacation", "holiday", "plan", "guide", "getaway", "days", "overview", "tour"}
+# Words of budget lines and labels ("Price Range", "Pro Tip", "Total Budget Breakdown")
+LABEL_WORDS = {
+    "budget", "budgets", "price", "prices", "pricing", "cost", "costs", "total", "totals", "subtotal", "summary",
+    "breakdown", "estimate", "estimated", "expense", "expenses", "fee", "fees", "tip", "tips",
+}
+MAX_NAME_WORDS = 7
+
+def normalize_word(word):
+    word = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in word if not unicodedata.combining(c)).replace("’", "'")
+
+def normalize_name(name):
+    return " ".join(normalize_word(word) for word in WORD.findall(name))
+
+# Aho-Corasick over words instead of characters: far fewer nodes, and matches always
+# start and end on word boundaries
+class WordMatcher:
+    def __init__(self, names):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [0]   # Length in words of the longest name ending at the node, 0 if none
+        for name in names:
+            words = normalize_name(name).split()
+            if not words:
+                continue
+            node = 0
+            for word in words:
+                if word not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(0)
+                    self.goto[node][word] = len(self.goto) - 1
+                node = self.goto[node][word]
+            self.output[node] = max(self.output[node], len(words))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.output[child] = max(self.output[child], self.output[self.fail[child]])
+
+    def __len__(self):
+        return len(self.goto) - 1
+
+    # (first word index, last word index + 1) of the longest match ending at each word
+    def find(self, words):
+        node = 0
+        for i, word in enumerate(words):
+            while node and word not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(word, 0)
+            if self.output[node]:
+                yield i + 1 - self.output[node], i + 1
+
+def clean_candidate(text):
+    text = re.sub(r"\(.*?\)|\[.*?\]", "", text)       # "(€17)", "[link]"
+    text = re.split(r"[:–—|]| - ", text)[0]             # "Louvre Museum: ..." / "Louvre - ..."
+    text = text.strip(" \t*_`#.,;!?\"'")
+    return " ".join(text.split())
+
+def is_place_name(name):
+    words = name.split()
+    if not words or len(words) > MAX_NAME_WORDS or len(name) < 3:
+        return False
+    if not (name[0].isupper() or not name[0].isascii()) or name[0].isdigit():
+        return False
+    normalized = normalize_name(name)
+    if normalized in LABELS or not (TITLE_WORDS | LABEL_WORDS).isdisjoint(normalized.split()):
+        return False
+    return not re.match(r"(?:day|night|week|step|option)\s*\d", normalized)
+
+# "Paris, France" and "paris" share one dictionary
+def destination_key(destination):
+    return normalize_name(destination.split(",")[0]) if destination else ""
+
+class PlaceExtractor:
+    # names: destination -> names of the places known there. known: optional check of a name
+    # against another source (e.g. the gazetteer), used by confidence()
+    def __init__(self, names=None, known=None):
+        self.names = {}
+        for destination, destination_names in (names or {}).items():
+            self.names.setdefault(destination_key(destination), []).extend(destination_names)
+        self.known = known
+        self.dictionaries = {}   # destination key -> (WordMatcher, normalized names)
+        self.lock = threading.Lock()
+
+    # Dictionary of a destination, built on first use; only names seen with that destination match
+    def dictionary(self, destination):
+        key = destination_key(destination)
+        with self.lock:
+            if key in self.dictionaries:
+                return self.dictionaries[key]
+        names = self.names.get(key, []) if key else []
+        dictionary = (WordMatcher(names), {normalize_name(name) for name in names})
+        with self.lock:
+            return self.dictionaries.setdefault(key, dictionary)
+
+    # Destination of the plan: the given one, else a "trip to X" phrase in the headings or first lines
+    @staticmethod
+    def find_destination(text, destination=None):
+        if destination and destination.strip():
+            return " ".join(destination.split())
+        headings = HEADING.findall(text)
+        for source in headings[:3] + text.splitlines()[:5]:
+            match = DESTINATION.search(source.replace("*", ""))
+            if match:
+                return match.group(1).strip()
+        return None
+
+    # Returns (destination, [places]) in order of first mention; places never repeat the destination
+    def extract(self, text, destination=None):
+        destination = self.find_destination(text, destination)
+        found = []
+
+        for match in BOLD.finditer(text):
+            found.append((match.start(), clean_candidate(match.group(1) or match.group(2))))
+        for match in HEADING.finditer(text):
+            found.append((match.start(1), clean_candidate(match.group(1))))
+
+        matcher = self.dictionary(destination)[0]
+        if len(matcher):
+            spans = [(m.start(), m.end()) for m in WORD.finditer(text)]
+            words = [normalize_word(text[start:end]) for start, end in spans]
+            for first, last in matcher.find(words):
+                found.append((spans[first][0], text[spans[first][0]:spans[last - 1][1]]))
+
+        places = []
+        # "Paris, France" also rules out "Paris"
+        seen = {normalize_name(destination), normalize_name(destination.split(",")[0])} if destination else set()
+        for _, name in sorted(found, key=lambda item: item[0]):
+            key = normalize_name(name)
+            if key in seen or not is_place_name(name):
+                continue
+            seen.add(key)
+            places.append(name)
+        return destination, places
+
+    # Share of places that are in the destination's dictionary or pass the known check, 0 without places
+    def confidence(self, destination, places):
+        if not places:
+            return 0.0
+        dictionary = self.dictionary(destination)[1]
+        verified = sum(1 for place in places if normalize_name(place) in dictionary or (self.known and self.known(place)))
+        return verified / len(places)
@@ -0,0 +1,357 @@
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+from metrics import metrics, log_event
+
+# Candidate models per task, in order of preference. Cheap tasks go to the small model first,
+# full itineraries to the 70B models; the later entries are fallbacks.
+LARGE_MODEL = os.getenv("LARGE_MODEL", "llama-3.3-70b-versatile")
+PLAN_MODEL = os.getenv("PLAN_MODEL", "llama3-70b-8192")
+FAST_MODEL = os.getenv("FAST_MODEL", "llama-3.1-8b-instant")
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", FAST_MODEL)
+
+def model_list(name, default):
+    return [model.strip() for model in os.getenv(name, ",".join(default)).split(",") if model.strip()]
+
+TASK_MODELS = {
+    "plan": model_list("PLAN_MODELS", [PLAN_MODEL, LARGE_MODEL]),
+    "chat": model_list("CHAT_MODELS", [LARGE_MODEL, PLAN_MODEL]),
+    "chat_short": model_list("CHAT_SHORT_MODELS", [FAST_MODEL, LARGE_MODEL]),
+    "extract_places": model_list("EXTRACT_MODELS", [FAST_MODEL, LARGE_MODEL]),
+    "summary": model_list("SUMMARY_MODELS", [SUMMARY_MODEL, LARGE_MODEL]),
+    "translate": model_list("TRANSLATE_MODELS", [FAST_MODEL, LARGE_MODEL]),
+}
+
+# Hedging: if a model has not produced its first token after its hedge delay, the next candidate
+# is started as well and whichever answers first is kept. The delay follows the model's own
+# rolling p95 time to first token, clamped to [ROUTER_HEDGE_MIN, ROUTER_HEDGE_MAX] seconds.
+ROUTER_HEDGE_MIN = float(os.getenv("ROUTER_HEDGE_MIN", 1.5))
+ROUTER_HEDGE_MAX = float(os.getenv("ROUTER_HEDGE_MAX", 4.0))
+ROUTER_COMPLETE_HEDGE = float(os.getenv("ROUTER_COMPLETE_HEDGE", 8.0))  # Non-streaming calls
+ROUTER_MAX_HEDGES = int(os.getenv("ROUTER_MAX_HEDGES", 1))
+# Rolling window per model. A model failing more than ROUTER_MAX_ERROR_RATE of its recent
+# calls is tried last until it recovers.
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", 50))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", 5))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.5))
+# Pre-warmed streams (the example prompts) are replayed from memory for this long
+ROUTER_WARM_TTL = int(os.getenv("ROUTER_WARM_TTL", 6 * 3600))
+
+metrics.describe("tripper_model_requests_total", "LLM calls by task, model and outcome")
+metrics.describe("tripper_model_hedges_total", "Hedged second requests started after a slow first token")
+metrics.describe("tripper_model_failovers_total", "Requests moved to the next model after an error")
+metrics.describe("tripper_singleflight_total", "Streams by role: leader (upstream call), follower (joined an identical in-flight stream) or warm (replayed)")
+
+class ModelStats:
+    def __init__(self, window):
+        self.ttft = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def error_rate(self):
+        if len(self.outcomes) < ROUTER_MIN_SAMPLES:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def ttft_quantile(self, q):
+        if len(self.ttft) < ROUTER_MIN_SAMPLES:
+            return None
+        return statistics.quantiles(self.ttft, n=100, method="inclusive")[int(q * 100) - 1]
+
+class AllModelsFailed(Exception):
+    pass
+
+# One upstream stream shared by every identical request that arrives while it runs.
+# Chunks are kept so late subscribers replay from the start before following live.
+class Flight:
+    def __init__(self):
+        self.started = asyncio.get_running_loop().create_future()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.pump = None
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self.notify()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def subscribe(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.error:
+                raise self.error
+            if self.done:
+                return
+            await self.changed.wait()
+
+# Picks a model per task from TASK_MODELS, keeps rolling latency and error rates per model,
+# hedges slow first tokens and fails over to the next model on errors.
+class ModelRouter:
+    def __init__(self, client_factory, task_models):
+        self.client_factory = client_factory
+        self.task_models = task_models
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.warm = {}
+        # Awaited before every upstream request, hedges and failovers included (batch_plans
+        # uses it for its rate limit)
+        self.before_request = None
+        self.max_hedges = ROUTER_MAX_HEDGES
+
+    def model_stats(self, model):
+        with self.lock:
+            if model not in self.stats:
+                self.stats[model] = ModelStats(ROUTER_WINDOW)
+            return self.stats[model]
+
+    # Candidates in preference order, with unhealthy models moved to the back
+    def candidates(self, task):
+        models = self.task_models.get(task) or self.task_models["chat"]
+        healthy = [m for m in models if self.model_stats(m).error_rate() <= ROUTER_MAX_ERROR_RATE]
+        return healthy + [m for m in models if m not in healthy]
+
+    def hedge_delay(self, model):
+        p95 = self.model_stats(model).ttft_quantile(0.95)
+        if p95 is None:
+            return ROUTER_HEDGE_MAX
+        return min(max(p95 * 1.5, ROUTER_HEDGE_MIN), ROUTER_HEDGE_MAX)
+
+    def record(self, task, model, ok, ttft=None):
+        stats = self.model_stats(model)
+        with self.lock:
+            stats.outcomes.append(ok)
+            if ttft is not None:
+                stats.ttft.append(ttft)
+        metrics.inc("tripper_model_requests_total", task=task, model=model, outcome="ok" if ok else "error")
+
+    # Runs attempt(model) on the candidates until one succeeds. A candidate is started early when
+    # the running ones are past their hedge delay, and right away when one of them fails.
+    # discard(result) releases the results of attempts that finished but lost the race.
+    async def race(self, task, attempt, hedge_delay, discard=None):
+        candidates = self.candidates(task)
+        running = {}
+        errors = []
+        hedges = 0
+        index = 0
+
+        def launch():
+            nonlocal index
+            model = candidates[index]
+            index += 1
+            running[asyncio.ensure_future(attempt(model))] = model
+
+        launch()
+        try:
+            while running:
+                timeout = None
+                if index < len(candidates) and hedges < self.max_hedges:
+                    timeout = hedge_delay(candidates[index - 1])
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedges += 1
+                    metrics.inc("tripper_model_hedges_total", task=task, model=candidates[index - 1])
+                    log_event("model_hedge", task=task, slow_model=candidates[index - 1], hedge_model=candidates[index])
+                    launch()
+                    continue
+
+                winner = None
+                for future in done:
+                    model = running.pop(future)
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        self.record(task, model, False)
+                        log_event("model_error", task=task, model=model, error=repr(future.exception()))
+                    elif winner is None:
+                        winner = model, future.result()
+                    elif discard:
+                        await discard(future.result())
+                if winner:
+                    return winner
+                if not running and index < len(candidates):
+                    metrics.inc("tripper_model_failovers_total", task=task, model=candidates[index - 1])
+                    launch()
+            raise AllModelsFailed(f"All models failed for {task}: {errors[-1]!r}") from errors[-1]
+        finally:
+            for future in running:
+                future.cancel()
+            if running:
+                await asyncio.wait(running)
+
+    @staticmethod
+    def flight_key(task, params):
+        payload = json.dumps([task, params], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Streaming chat completion. Returns (model, chunks); chunks is an async iterator of
+    # completion chunks like the stream returned by the client. Identical requests (same task,
+    # so same models, and same messages and parameters) share one upstream stream.
+    async def stream(self, task, **params):
+        key = self.flight_key(task, params)
+        warm = self.warm.get(key)
+        if warm and warm[0] > time.monotonic():
+            metrics.inc("tripper_singleflight_total", task=task, role="warm")
+            return warm[1], self.replay(warm[2])
+
+        flight = self.flights.get(key)
+        if flight is None:
+            role = "leader"
+            flight = self.flights[key] = Flight()
+            flight.pump = asyncio.create_task(self.run_flight(key, flight, task, params))
+        else:
+            role = "follower"
+        metrics.inc("tripper_singleflight_total", task=task, role=role)
+        flight.subscribers += 1
+        try:
+            model = await asyncio.shield(flight.started)
+        except BaseException:
+            self.leave(key, flight)
+            raise
+        return model, self.follow(key, flight)
+
+    @staticmethod
+    async def replay(chunks):
+        for chunk in chunks:
+            yield chunk
+
+    async def follow(self, key, flight):
+        try:
+            async for chunk in flight.subscribe():
+                yield chunk
+        finally:
+            self.leave(key, flight)
+
+    # The upstream stream is cancelled once nobody is listening any more
+    def leave(self, key, flight):
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.done:
+            flight.pump.cancel()
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    async def run_flight(self, key, flight, task, params):
+        try:
+            try:
+                model, chunks = await self.open_stream(task, **params)
+            except asyncio.CancelledError:
+                flight.started.cancel()
+                raise
+            except Exception as e:
+                flight.started.set_exception(e)
+                flight.finish(e)
+                return
+            flight.started.set_result(model)
+            try:
+                async for chunk in chunks:
+                    flight.append(chunk)
+            except asyncio.CancelledError:
+                flight.finish(AllModelsFailed(f"Stream for {task} was cancelled"))
+                raise
+            except Exception as e:
+                flight.finish(e)
+                return
+            flight.finish()
+            if key in self.warm:
+                self.warm[key] = (time.monotonic() + ROUTER_WARM_TTL, model, flight.chunks)
+        finally:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    # Runs a stream to the end and keeps it, so identical requests are answered from memory.
+    # Warm entries are refreshed whenever the same request is streamed again after they expire.
+    async def prewarm(self, task, **params):
+        key = self.flight_key(task, params)
+        self.warm.setdefault(key, (0, None, []))
+        model, chunks = await self.stream(task, **params)
+        async for _ in chunks:
+            pass
+        return model
+
+    async def create(self, model, **params):
+        if self.before_request:
+            await self.before_request()
+        return await self.client_factory().chat.completions.create(model=model, **params)
+
+    async def open_stream(self, task, **params):
+        async def attempt(model):
+            started = time.perf_counter()
+            completion = await self.create(model, stream=True, **params)
+            iterator = completion.__aiter__()
+            buffered = []
+            try:
+                # Wait for the first chunk with text, the stream only counts as started then
+                while True:
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    buffered.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        break
+            except BaseException:
+                await completion.close()
+                raise
+            self.record(task, model, True, time.perf_counter() - started)
+            return completion, iterator, buffered
+
+        async def discard(result):
+            await result[0].close()
+
+        model, (completion, iterator, buffered) = await self.race(task, attempt, self.hedge_delay, discard)
+
+        async def chunks():
+            try:
+                for chunk in buffered:
+                    yield chunk
+                async for chunk in iterator:
+                    yield chunk
+            except Exception:
+                # Text has been shown already, so there is no failing over past this point
+                self.record(task, model, False)
+                raise
+            finally:
+                await completion.close()
+
+        return model, chunks()
+
+    # Non-streaming chat completion. Returns (model, response).
+    async def complete(self, task, **params):
+        async def attempt(model):
+            started = time.perf_counter()
+            response = await self.create(model, **params)
+            self.record(task, model, True)
+            log_event("model_complete", task=task, model=model, duration_ms=round((time.perf_counter() - started) * 1000, 1))
+            return response
+
+        return await self.race(task, attempt, lambda model: ROUTER_COMPLETE_HEDGE)
+
+    # Rolling per model error rate and time to first token, for the metrics endpoint
+    def collect(self):
+        samples = []
+        with self.lock:
+            for model, model_stats in self.stats.items():
+                samples.append(("tripper_model_error_rate", {"model": model}, model_stats.error_rate()))
+                for q in (0.5, 0.95):
+                    value = model_stats.ttft_quantile(q)
+                    if value is not None:
+                        samples.append(("tripper_model_ttft_seconds", {"model": model, "quantile": q}, value))
+        return samples
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+# Per session state (chat history, last plan) kept by session id instead of in the browser
+# or in module globals, so a request only carries the id and any worker can serve any session.
+# Values are stored as JSON in both backends, so they behave the same.
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")   # "memory" or "sqlite"
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+SESSION_CLEANUP_EVERY = 200  # Writes between two expiry sweeps
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and re.fullmatch(r"[0-9a-f]{32}", session_id) is not None
+
+# Single process only, state is lost on restart
+class MemorySessionStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, session_id, field, default=None):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session or field not in session["fields"]:
+                return default
+            return json.loads(session["fields"][field])
+
+    def set(self, session_id, field, value):
+        now = time.time()
+        with self.lock:
+            session = self.sessions.setdefault(session_id, {"fields": {}, "updated_at": now})
+            session["fields"][field] = json.dumps(value, ensure_ascii=False)
+            session["updated_at"] = now
+            self._writes += 1
+            if self._writes % SESSION_CLEANUP_EVERY == 0:
+                self._expire(now)
+
+    # Adds items to a list field in one step, so two tabs of a session never drop each other's
+    # items. With limit, only the last limit items are kept.
+    def append(self, session_id, field, items, limit=None):
+        now = time.time()
+        with self.lock:
+            session = self.sessions.setdefault(session_id, {"fields": {}, "updated_at": now})
+            value = json.loads(session["fields"].get(field, "[]")) + list(items)
+            if limit:
+                value = value[-limit:]
+            session["fields"][field] = json.dumps(value, ensure_ascii=False)
+            session["updated_at"] = now
+
+    def delete(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def _expire(self, now):
+        for session_id in [s for s, session in self.sessions.items() if session["updated_at"] < now - self.ttl]:
+            del self.sessions[session_id]
+
+# A SQLite file standing in for a shared store: worker processes on the same host share it.
+# WAL mode lets readers in other processes work while one of them writes.
+class SQLiteSessionStore:
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+
+    # Opened on first use, so processes that only import the app never touch the file
+    @property
+    def db(self):
+        with self._db_lock:
+            if self._db is None:
+                db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS session ("
+                    "session_id TEXT, field TEXT, value TEXT, updated_at REAL, PRIMARY KEY (session_id, field))"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS session_updated_at ON session (updated_at)")
+                db.commit()
+                self._db = db
+            return self._db
+
+    def get(self, session_id, field, default=None):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM session WHERE session_id = ? AND field = ?", (session_id, field)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, session_id, field, value):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO session (session_id, field, value, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, field, json.dumps(value, ensure_ascii=False), now)
+            )
+            self._writes += 1
+            if self._writes % SESSION_CLEANUP_EVERY == 0:
+                self._expire(now)
+            self.db.commit()
+
+    # Read and write in one IMMEDIATE transaction, so appends from other processes are not lost.
+    # With limit, only the last limit items are kept.
+    def append(self, session_id, field, items, limit=None):
+        now = time.time()
+        with self.lock:
+            db = self.db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT value FROM session WHERE session_id = ? AND field = ?", (session_id, field)
+                ).fetchone()
+                value = (json.loads(row[0]) if row else []) + list(items)
+                if limit:
+                    value = value[-limit:]
+                db.execute(
+                    "INSERT OR REPLACE INTO session (session_id, field, value, updated_at) VALUES (?, ?, ?, ?)",
+                    (session_id, field, json.dumps(value, ensure_ascii=False), now)
+                )
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+
+    def delete(self, session_id):
+        with self.lock:
+            self.db.execute("DELETE FROM session WHERE session_id = ?", (session_id,))
+            self.db.commit()
+
+    # A session expires as a whole once none of its fields was written within the TTL
+    def _expire(self, now):
+        self.db.execute(
+            "DELETE FROM session WHERE session_id IN "
+            "(SELECT session_id FROM session GROUP BY session_id HAVING MAX(updated_at) < ?)",
+            (now - self.ttl,)
+        )
+
+def open_session_store(kind, path, ttl=SESSION_TTL):
+    if kind == "memory":
+        return MemorySessionStore(ttl)
+    if kind == "sqlite":
+        return SQLiteSessionStore(path, ttl)
+    raise ValueError(f"Unknown SESSION_STORE {kind!r}, expected 'memory' or 'sqlite'")
@@ -0,0 +1,149 @@
+import os
+import importlib.util
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import speech_recognition as sr
+from http_clients import get_session, REQUEST_TIMEOUT
+
+# Speech recognition settings
+# "local" runs faster-whisper on the CPU, "google" uses the Google Web Speech API,
+# "auto" picks local when faster-whisper is installed
+SPEECH_BACKEND = os.getenv("SPEECH_BACKEND", "auto")
+SPEECH_MODEL = os.getenv("SPEECH_MODEL", "base")
+SPEECH_CHUNK_SECONDS = float(os.getenv("SPEECH_CHUNK_SECONDS", 30))
+# Chunks are cut at the quietest point of their last SPEECH_CUT_SEARCH seconds, not in mid word
+SPEECH_CUT_SEARCH = float(os.getenv("SPEECH_CUT_SEARCH", 2))
+SPEECH_CUT_WINDOW = 0.03
+SPEECH_WORKERS = int(os.getenv("SPEECH_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Loaded once per process, so pool workers keep the model warm between files
+_local_model = None
+
+def _recognize_local(recognizer, audio):
+    global _local_model
+    import numpy as np
+    from faster_whisper import WhisperModel
+
+    if _local_model is None:
+        _local_model = WhisperModel(SPEECH_MODEL, device="cpu", compute_type="int8")
+    pcm = audio.get_raw_data(convert_rate=16000, convert_width=2)
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    segments, _ = _local_model.transcribe(samples, beam_size=1)
+    text = " ".join(segment.text.strip() for segment in segments)
+    if not text:
+        raise sr.UnknownValueError()
+    return text
+
+# Google voice recognition. Builds the same request as recognizer.recognize_google, which
+# opens a new connection each time, and sends it over this process's keep-alive session.
+# The request builder and parser are internals of the SpeechRecognition version pinned in
+# requirements.txt; without them it falls back to recognize_google.
+def _recognize_google(recognizer, audio):
+    try:
+        from speech_recognition.recognizers import google
+        request = google.create_request_builder(endpoint=google.ENDPOINT).build(audio)
+        parser = google.OutputParser(show_all=False, with_confidence=False)
+    except (ImportError, AttributeError):
+        return recognizer.recognize_google(audio)  # SpeechRecognition version without them
+    import requests
+    try:
+        response = get_session("google_speech").post(
+            request.full_url, data=request.data, headers=dict(request.header_items()), timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise sr.RequestError(f"recognition request failed: {e}")
+    return parser.parse(response.text)
+
+SPEECH_BACKENDS = {
+    "local": _recognize_local,
+    "google": _recognize_google,
+}
+
+def speech_backend():
+    if SPEECH_BACKEND == "auto":
+        return "local" if importlib.util.find_spec("faster_whisper") else "google"
+    return SPEECH_BACKEND
+
+# Frame index of the quietest SPEECH_CUT_WINDOW in the last SPEECH_CUT_SEARCH seconds of data
+def quietest_frame(data, rate, width):
+    import numpy as np
+    samples = np.frombuffer(sr.AudioData(data, rate, width).get_raw_data(convert_width=2), dtype=np.int16).astype(np.float32)
+    window = max(int(rate * SPEECH_CUT_WINDOW), 1)
+    start = max(len(samples) - int(rate * SPEECH_CUT_SEARCH), 0)
+    count = (len(samples) - start) // window
+    if count == 0:
+        return len(samples)
+    energy = (samples[start:start + count * window].reshape(count, window) ** 2).mean(axis=1)
+    return start + int(np.argmin(energy)) * window + window // 2
+
+# Reads a voice file a chunk at a time so long recordings are never loaded whole. Each full
+# chunk ends at a pause; the audio after it is carried over to the next chunk.
+# (recognizer.record drops the buffer that crosses the duration, so the stream is read directly.)
+def audio_chunks(source):
+    rate, width = source.SAMPLE_RATE, source.SAMPLE_WIDTH
+    frames = int(rate * SPEECH_CHUNK_SECONDS)
+    carry = b""
+    while True:
+        read = source.stream.read(frames)
+        data = carry + read
+        if len(read) < frames * width:  # End of the file
+            if data:
+                yield sr.AudioData(data, rate, width)
+            return
+        cut = quietest_frame(data, rate, width) * width
+        carry = data[cut:]
+        yield sr.AudioData(data[:cut], rate, width)
+
+def transcribe_audio(audio_path):
+    recognize = SPEECH_BACKENDS[speech_backend()]
+    recognizer = sr.Recognizer()
+    parts = []
+    with sr.AudioFile(audio_path) as source:
+        for audio in audio_chunks(source):
+            try:
+                parts.append(recognize(recognizer, audio))
+            except sr.UnknownValueError:
+                continue
+            except sr.RequestError:
+                return "Not avaliable"
+    if not parts:
+        return "Cannot read voice"
+    return " ".join(parts)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Workers are forked from a forkserver rather than from the web server, which has running
+# threads that fork does not copy safely. Spawned processes re-run the main script as
+# __mp_main__; the forkserver does that once and its children inherit it, together with this
+# module and the speech recognition imports. Platforms without forkserver spawn instead.
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["__main__", "speech"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=SPEECH_WORKERS, mp_context=context)
+        return _pool
+
+def _ready():
+    return True
+
+# Starts every worker ahead of the first upload (one task each makes the pool start them all);
+# blocks until the tasks ran and returns how many did
+def warm_up():
+    if SPEECH_WORKERS <= 1:
+        return 0
+    pool = _get_pool()
+    return sum(future.result() for future in [pool.submit(_ready) for _ in range(SPEECH_WORKERS)])
+
+# Transcribes several files in parallel on a process pool; results keep the input order
+def transcribe_files(audio_paths):
+    if len(audio_paths) <= 1:
+        return [transcribe_audio(path) for path in audio_paths]
+    return list(_get_pool().map(transcribe_audio, audio_paths))
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# app.py reads its settings at import time: keep its caches and databases out of the checkout
+os.environ.setdefault("TRIPPER_CACHE_DIR", tempfile.mkdtemp(prefix="tripper-tests-"))
+os.environ.setdefault("GROQ_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+import pytest
+
+import gazetteer
+
+PARIS = (48.8566, 2.3522)
+TEXAS = (33.6609, -95.5555)
+
+# geonameid, name, asciiname, alternatenames, latitude, longitude, feature class, feature code,
+# country, cc2, admin1-4, population, elevation, dem, timezone, modification date
+ROWS = [
+    ("2988507", "Paris", "Paris", "Lutetia,Paname", *PARIS, "P", "PPLC", "FR", "", "11", "75", "", "", "2138551", "", "42", "Europe/Paris", "2024-01-01"),
+    ("4717560", "Paris", "Paris", "", *TEXAS, "P", "PPLA2", "US", "", "TX", "277", "", "", "24171", "", "183", "America/Chicago", "2024-01-01"),
+    ("6254976", "Tour Eiffel", "Tour Eiffel", "Eiffel Tower", 48.8584, 2.2945, "S", "TOWR", "FR", "", "11", "75", "", "", "0", "", "33", "Europe/Paris", "2024-01-01"),
+    ("6254978", "Musée du Louvre", "Musee du Louvre", "Louvre Museum", 48.8606, 2.3376, "S", "MUS", "FR", "", "11", "75", "", "", "0", "", "35", "Europe/Paris", "2024-01-01"),
+]
+
+
+@pytest.fixture
+def dump(tmp_path):
+    path = tmp_path / "fixture.txt"
+    lines = ["\t".join(str(column) for column in row) for row in ROWS]
+    lines.append("1\tBroken\tBroken\t\tnot a latitude\t2.0\tP\tPPL\tFR\t\t\t\t\t\t0\t\t\tEurope/Paris\t2024-01-01")
+    lines.append("2\ttoo\tfew\tcolumns")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def index(dump, tmp_path):
+    directory = tmp_path / "gazetteer"
+    assert gazetteer.build(str(dump), str(directory)) == len(ROWS)
+    return gazetteer.load_gazetteer(str(directory))
+
+
+def test_missing_index_is_not_loaded(tmp_path):
+    assert gazetteer.load_gazetteer(str(tmp_path)) is None
+
+
+def test_feature_classes_filter_the_dump(dump, tmp_path):
+    assert gazetteer.build(str(dump), str(tmp_path / "places"), {"P"}) == 2
+
+
+def test_exact_lookup_prefers_population_then_distance(index):
+    assert index.lookup("Paris") == pytest.approx(list(PARIS), abs=1e-4)
+    assert index.lookup("Paris", near=TEXAS) == pytest.approx(list(TEXAS), abs=1e-4)
+    assert index.lookup("paris", near=PARIS, radius_km=5) == pytest.approx(list(PARIS), abs=1e-4)
+
+
+def test_lookup_by_ascii_and_alternate_names(index):
+    assert index.lookup("Musee du Louvre", near=PARIS) == pytest.approx([48.8606, 2.3376], abs=1e-4)
+    assert index.lookup("The Eiffel Tower, Paris", near=PARIS) == pytest.approx([48.8584, 2.2945], abs=1e-4)
+    assert index.stats["hits"] == 2
+
+
+def test_fuzzy_lookup_only_near_a_point(index):
+    assert index.lookup("Eifel Tower", near=PARIS) == pytest.approx([48.8584, 2.2945], abs=1e-4)
+    assert index.stats["fuzzy_hits"] == 1
+    assert index.lookup("Eifel Tower") is None
+    assert index.lookup("Eifel Tower", near=TEXAS) is None
+    assert index.stats["misses"] == 2
+
+
+def test_knows(index):
+    assert index.knows("Lutetia")
+    assert index.knows("Louvre Museum, Paris")
+    assert not index.knows("Atlantis")
@@ -0,0 +1,24 @@
+from metrics import Metrics
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.inc("tripper_errors_total", stage="plan", error='bad "value"\\path\nnext')
+    assert 'error="bad \\"value\\"\\\\path\\nnext"' in metrics.render()
+
+
+def test_help_text_is_escaped():
+    metrics = Metrics()
+    metrics.describe("tripper_test", "first line\nsecond \\ line")
+    metrics.inc("tripper_test")
+    assert "# HELP tripper_test first line\\nsecond \\\\ line" in metrics.render()
+
+
+def test_collector_kinds():
+    metrics = Metrics()
+    metrics.describe("tripper_collected_total", "Collected", kind="counter")
+    metrics.register_collector(lambda: [("tripper_collected_total", {"client": "a"}, 3), ("tripper_idle", {}, 1)])
+    text = metrics.render()
+    assert "# TYPE tripper_collected_total counter" in text
+    assert "# TYPE tripper_idle gauge" in text
+    assert 'tripper_collected_total{client="a"} 3' in text
@@ -0,0 +1,54 @@
+import pytest
+
+from place_extractor import PlaceExtractor, WordMatcher, normalize_name
+
+PLAN = """# 3-Day Trip to Paris
+
+## Day 1
+**Morning:** Start at the **Louvre Museum** (€17) and walk to the Tuileries Garden.
+**Lunch:** A crêpe near **Notre-Dame de Paris**.
+**Estimated Cost:** 60 EUR
+
+### Musée d'Orsay
+**Evening:** Dinner in **Paris**, then a walk along the Canal Saint-Martin.
+"""
+
+
+def test_extract_keeps_places_and_skips_labels():
+    destination, places = PlaceExtractor().extract(PLAN)
+    assert destination == "Paris"
+    assert places == ["Louvre Museum", "Notre-Dame de Paris", "Musée d'Orsay"]
+
+
+def test_dictionary_names_are_found_in_plain_text():
+    extractor = PlaceExtractor({"Paris, France": ["Tuileries Garden", "Canal Saint-Martin"]})
+    _, places = extractor.extract(PLAN, "Paris")
+    assert places == ["Louvre Museum", "Tuileries Garden", "Notre-Dame de Paris", "Musée d'Orsay", "Canal Saint-Martin"]
+
+
+def test_dictionary_is_scoped_to_its_destination():
+    extractor = PlaceExtractor({"Lyon": ["Tuileries Garden"]})
+    _, places = extractor.extract(PLAN, "Paris")
+    assert "Tuileries Garden" not in places
+
+
+def test_given_destination_is_not_listed_as_a_place():
+    _, places = PlaceExtractor().extract("Visit **Kyoto** and **Fushimi Inari Taisha**.", "Kyoto, Japan")
+    assert places == ["Fushimi Inari Taisha"]
+
+
+@pytest.mark.parametrize("places, expected", [
+    ([], 0.0),
+    (["Louvre Museum", "Tuileries Garden"], 1.0),
+    (["Louvre Museum", "Somewhere Unknown"], 0.5),
+    (["Somewhere Unknown"], 0.0),
+])
+def test_confidence_is_the_share_of_known_places(places, expected):
+    extractor = PlaceExtractor({"Paris": ["Louvre Museum"]}, known=lambda name: name == "Tuileries Garden")
+    assert extractor.confidence("Paris", places) == expected
+
+
+def test_word_matcher_prefers_the_longest_name():
+    matcher = WordMatcher(["Saint Martin", "Canal Saint Martin"])
+    words = normalize_name("along the canal Saint-Martin today").split()
+    assert list(matcher.find(words)) == [(2, 5)]
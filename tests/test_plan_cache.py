@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import app
+
+
+def key(budget, currency="USD", destination="Paris"):
+    return app.plan_cache_key("", destination, "museums", 3, budget, "", 2, currency)
+
+
+def budget_of(cache_key):
+    return json.loads(cache_key)[4]
+
+
+def test_no_budget_has_its_own_key():
+    assert budget_of(key(None)) is None
+    assert key(None) == key(0) == key(100)
+
+
+def test_small_budgets_do_not_share_the_no_budget_key():
+    assert key(150) != key(None)
+    assert key(249) != key(None)
+    assert key(10000, "JPY") != key(None, "JPY")
+
+
+def test_close_budgets_share_a_bucket():
+    assert key(1000) == key(1100)
+    assert key(1000) != key(3000)
+
+
+def test_text_fields_are_normalized():
+    assert key(1000, destination="Paris") == key(1000, destination="  paris. ")
+
+
+def test_currency_is_part_of_the_key():
+    assert key(1000, "USD") != key(1000, "EUR")
+
+
+def test_cached_plan_without_places_extracts_them_again(monkeypatch):
+    cache_key = key(2000, destination="Lisbon")
+    app.plan_cache.put(cache_key, "Day 1: **Belem Tower**", "", "🇬🇧 English")
+
+    async def extract_places(trip_text, destination=None):
+        return "Lisbon\nBelem Tower"
+    monkeypatch.setattr(app, "extract_places", extract_places)
+
+    async def run():
+        return [output async for output in app.generate_plan("", "Lisbon", "museums", 3, 2000, "", 2, "USD", "🇬🇧 English", with_map=False)]
+
+    outputs = asyncio.run(run())
+    assert outputs[-1][:2] == ("Day 1: **Belem Tower**", "Lisbon\nBelem Tower")
+    assert app.plan_cache.get(cache_key)["places"] == "Lisbon\nBelem Tower"
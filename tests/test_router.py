@@ -0,0 +1,133 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from router import ModelRouter, AllModelsFailed
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeStream:
+    def __init__(self, texts, delay=0):
+        self.texts = texts
+        self.delay = delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for text in self.texts:
+            await asyncio.sleep(self.delay)
+            yield chunk(text)
+
+    async def close(self):
+        self.closed = True
+
+
+# Stand-in for AsyncGroq: answers per model, an Exception instance makes that model fail
+class FakeClient:
+    def __init__(self, answers, delay=0):
+        self.answers = answers
+        self.delay = delay
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, stream=False, **params):
+        self.calls.append(model)
+        answer = self.answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        if stream:
+            return FakeStream(answer.split(" "), self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+
+def make_router(client, models=("first", "second")):
+    return ModelRouter(lambda: client, {"chat": list(models)})
+
+
+async def collect(chunks):
+    return [c.choices[0].delta.content async for c in chunks]
+
+
+def test_complete_fails_over_to_the_next_model():
+    client = FakeClient({"first": RuntimeError("down"), "second": "hello"})
+    router = make_router(client)
+    model, response = asyncio.run(router.complete("chat", messages=[]))
+    assert model == "second"
+    assert response.choices[0].message.content == "hello"
+    assert client.calls == ["first", "second"]
+    assert list(router.model_stats("first").outcomes) == [False]
+
+
+def test_stream_fails_over_to_the_next_model():
+    client = FakeClient({"first": RuntimeError("down"), "second": "a b c"})
+    router = make_router(client)
+
+    async def run():
+        model, chunks = await router.stream("chat", messages=[{"role": "user", "content": "hi"}])
+        return model, await collect(chunks)
+
+    assert asyncio.run(run()) == ("second", ["a", "b", "c"])
+
+
+def test_all_models_failing_raises():
+    client = FakeClient({"first": RuntimeError("down"), "second": RuntimeError("down too")})
+    with pytest.raises(AllModelsFailed):
+        asyncio.run(make_router(client).complete("chat", messages=[]))
+
+
+def test_identical_streams_share_one_upstream_call():
+    client = FakeClient({"first": "one two three", "second": "unused"}, delay=0.01)
+    router = make_router(client)
+
+    async def one():
+        model, chunks = await router.stream("chat", messages=[{"role": "user", "content": "same"}])
+        return model, await collect(chunks)
+
+    async def run():
+        return await asyncio.gather(one(), one(), one())
+
+    results = asyncio.run(run())
+    assert results == [("first", ["one", "two", "three"])] * 3
+    assert client.calls == ["first"]
+    assert router.flights == {}
+
+
+def test_different_streams_are_not_shared():
+    client = FakeClient({"first": "answer", "second": "unused"})
+    router = make_router(client)
+
+    async def one(text):
+        _, chunks = await router.stream("chat", messages=[{"role": "user", "content": text}])
+        return await collect(chunks)
+
+    async def run():
+        return await asyncio.gather(one("a"), one("b"))
+
+    asyncio.run(run())
+    assert client.calls == ["first", "first"]
+
+
+def test_before_request_runs_for_every_upstream_call():
+    client = FakeClient({"first": RuntimeError("down"), "second": "a b"})
+    router = make_router(client)
+    calls = []
+
+    async def before_request():
+        calls.append(len(client.calls))
+
+    router.before_request = before_request
+
+    async def run():
+        await router.complete("chat", messages=[])
+        _, chunks = await router.stream("chat", messages=[{"role": "user", "content": "hi"}])
+        await collect(chunks)
+
+    asyncio.run(run())
+    assert client.calls == ["first", "second", "first", "second"]
+    assert calls == [0, 1, 2, 3]
@@ -0,0 +1,56 @@
+import pytest
+
+import app
+from sessions import MemorySessionStore, SQLiteSessionStore, new_session_id, valid_session_id
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(ttl=3600)
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl=3600)
+
+
+def test_round_trip(store):
+    session_id = new_session_id()
+    assert store.get(session_id, "plan") is None
+    store.set(session_id, "plan", {"text": "Day 1", "places": "Paris\nLouvre"})
+    assert store.get(session_id, "plan") == {"text": "Day 1", "places": "Paris\nLouvre"}
+    store.delete(session_id)
+    assert store.get(session_id, "plan", {}) == {}
+
+
+def test_sqlite_store_survives_reopening(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    session_id = new_session_id()
+    SQLiteSessionStore(path, ttl=3600).set(session_id, "history", [{"role": "user", "content": "Hi"}])
+    assert SQLiteSessionStore(path, ttl=3600).get(session_id, "history") == [{"role": "user", "content": "Hi"}]
+
+
+def test_append_keeps_the_last_items(store):
+    session_id = new_session_id()
+    store.append(session_id, "history", [1, 2])
+    store.append(session_id, "history", [3])
+    assert store.get(session_id, "history") == [1, 2, 3]
+    store.append(session_id, "history", [4, 5], limit=3)
+    assert store.get(session_id, "history") == [3, 4, 5]
+
+
+def test_session_ids():
+    assert valid_session_id(new_session_id())
+    assert not valid_session_id("../etc/passwd")
+    assert not valid_session_id(None)
+
+
+def test_history_keeps_text_messages_only(monkeypatch):
+    monkeypatch.setattr(app, "SESSION_HISTORY_MESSAGES", 4)
+    session_id = new_session_id()
+    app.append_history(session_id, [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello"},
+        {"role": "assistant", "content": {"path": "/tmp/answer.mp3"}},
+        {"role": "assistant", "content": ""},
+    ])
+    assert app.load_history(session_id) == [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+    app.append_history(session_id, [{"role": "user", "content": "Next"}, {"role": "assistant", "content": "Sure"}, {"role": "user", "content": "Last"}])
+    assert [message["content"] for message in app.load_history(session_id)] == ["Hello", "Next", "Sure", "Last"]
@@ -0,0 +1,19 @@
+import speech
+
+
+def test_warm_up_starts_the_workers(monkeypatch):
+    monkeypatch.setattr(speech, "SPEECH_WORKERS", 2)
+    monkeypatch.setattr(speech, "_pool", None)
+    try:
+        assert speech.warm_up() == 2
+        assert len(speech._pool._processes) == 2
+    finally:
+        if speech._pool is not None:
+            speech._pool.shutdown()
+
+
+def test_warm_up_without_a_pool(monkeypatch):
+    monkeypatch.setattr(speech, "SPEECH_WORKERS", 1)
+    monkeypatch.setattr(speech, "_pool", None)
+    assert speech.warm_up() == 0
+    assert speech._pool is None
@@ -0,0 +1,80 @@
+import base64
+import json
+
+import pytest
+import requests
+import speech_recognition as sr
+from requests.adapters import BaseAdapter
+
+import app
+import http_clients
+import speech
+
+
+# Answers every request with the same canned body and keeps the requests it was sent
+class FakeAdapter(BaseAdapter):
+    def __init__(self, body, status=200):
+        super().__init__()
+        self.body = body
+        self.status = status
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        response = requests.Response()
+        response.status_code = self.status
+        response._content = self.body.encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def fake_session(monkeypatch, name, adapter):
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    monkeypatch.setitem(http_clients._sessions, name, session)
+
+
+def gtts_answer(audio):
+    audio = json.dumps([base64.b64encode(audio).decode("ascii")])
+    payload = json.dumps([["wrb.fr", "jQ1olc", audio, None, None, None, "generic"]], separators=(",", ":"))
+    return ")]}'\n\n" + str(len(payload)) + "\n" + payload + "\n"
+
+
+def test_synthesize_speech_sends_every_part_through_the_shared_session(monkeypatch):
+    from gtts import gTTS
+    adapter = FakeAdapter(gtts_answer(b"mp3"))
+    fake_session(monkeypatch, "gtts", adapter)
+    text = "A first sentence that is long enough to be sent on its own. " * 3
+    assert app.synthesize_speech(text, "en") == b"mp3" * len(adapter.requests)
+    assert len(adapter.requests) > 1
+    assert [r.url for r in adapter.requests] == [app.GTTS_URL.format(tld="com")] * len(adapter.requests)
+    assert [r.body for r in adapter.requests] == gTTS(text, lang="en").get_bodies()
+
+
+def test_synthesize_speech_without_audio_in_the_answer_fails(monkeypatch):
+    from gtts import gTTSError
+    fake_session(monkeypatch, "gtts", FakeAdapter(")]}'\n\n[]\n"))
+    with pytest.raises(gTTSError):
+        app.synthesize_speech("Hello there.", "en")
+
+
+def test_recognize_google_uses_the_shared_session(monkeypatch):
+    answer = '{"result":[]}\n{"result":[{"alternative":[{"transcript":"hello there","confidence":0.9}],"final":true}],"result_index":0}\n'
+    adapter = FakeAdapter(answer)
+    fake_session(monkeypatch, "google_speech", adapter)
+    audio = sr.AudioData(b"\0\0" * 16000, 16000, 2)
+    assert speech._recognize_google(sr.Recognizer(), audio) == "hello there"
+    assert len(adapter.requests) == 1
+    assert adapter.requests[0].url.startswith("http://www.google.com/speech-api/v2/recognize")
+
+
+def test_recognize_google_errors_are_request_errors(monkeypatch):
+    fake_session(monkeypatch, "google_speech", FakeAdapter("", status=500))
+    with pytest.raises(sr.RequestError):
+        speech._recognize_google(sr.Recognizer(), sr.AudioData(b"\0\0" * 16000, 16000, 2))
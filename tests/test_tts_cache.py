@@ -0,0 +1,24 @@
+import app
+
+
+def test_replacing_a_file_counts_its_size_once(tmp_path):
+    cache = app.TTSCache(str(tmp_path), max_bytes=1000)
+    cache.put("Hello.", "en", b"a" * 300)
+    cache.put("Hello.", "en", b"b" * 400)
+    assert cache.size == 400
+    assert cache.stats["evictions"] == 0
+
+
+def test_size_is_bounded(tmp_path):
+    cache = app.TTSCache(str(tmp_path), max_bytes=1000)
+    for i in range(5):
+        cache.put(f"Sentence {i}.", "en", b"x" * 300)
+    assert cache.size <= 1000
+    assert app.directory_size(str(tmp_path)) == cache.size
+
+
+def test_hits_are_counted(tmp_path):
+    cache = app.TTSCache(str(tmp_path), max_bytes=1000)
+    cache.put("Hello.", "en", b"audio")
+    assert cache.get("Hello.", "en") == b"audio"
+    assert cache.stats["hits"] == 1